@@ -1,20 +1,32 @@
 import asyncio
+import functools
 import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
 from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
 from telegram.constants import ParseMode
 import re
+import weakref
 from typing import List
 
-from config import TELEGRAM_BOT_TOKEN, CHECK_INTERVAL_MINUTES
+from config import TELEGRAM_BOT_TOKEN, CHECK_INTERVAL_MINUTES, MAX_CONCURRENT_CHECKS
 from database import Database
 from uniqlo_api import UniqloAPI
 from monitor import ProductMonitor
+from cache import TTLCache
+from ratelimit import RateLimiter
 
 # Setup logging - reduce spam from telegram library
+# Records go through a queue; log_listener writes them to stderr from its own thread
+# so a slow console never blocks the event loop
+_log_queue = queue.SimpleQueue()
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+log_listener = QueueListener(_log_queue, _log_handler)
 logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[QueueHandler(_log_queue)],
     level=logging.WARNING  # Only show warnings and errors, not info/debug
 )
 # Suppress telegram library verbose logging
@@ -23,34 +35,162 @@ logging.getLogger('httpx').setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
 # Initialize components
-db = Database('uniqlo_monitor.db')
+db = Database('uniqlo_monitor.db', pool_size=8)
 api = UniqloAPI()
 monitor = ProductMonitor(db, api)
 
+# Uniqlo product link; group 1 is the product ID with color code (e.g., E479678-000)
+PRODUCT_URL_RE = re.compile(r'uniqlo\.com\S*?/products/([A-Z0-9]+-\d{3})?')
+
+# Static keyboards (built once, reused on every menu render)
+MAIN_MENU_KEYBOARD = [
+    [InlineKeyboardButton("➕ Tambah Produk", callback_data='add_product')],
+    [InlineKeyboardButton("📋 Daftar Produk", callback_data='list_products')],
+    [InlineKeyboardButton("🏪 Kelola Toko", callback_data='manage_stores')]
+]
+MAIN_MENU_MARKUP = InlineKeyboardMarkup(MAIN_MENU_KEYBOARD)
+
+MANAGE_STORES_KEYBOARD = [
+    [InlineKeyboardButton("🔍 Cari Toko", callback_data='search_stores')],
+    [InlineKeyboardButton("📋 Toko Saya", callback_data='list_my_stores')],
+    [InlineKeyboardButton("🔙 Kembali", callback_data='back_to_menu')]
+]
+MANAGE_STORES_MARKUP = InlineKeyboardMarkup(MANAGE_STORES_KEYBOARD)
+
+LIST_MY_STORES_EMPTY_KEYBOARD = [
+    [InlineKeyboardButton("🔍 Cari Toko", callback_data='search_stores')],
+    [InlineKeyboardButton("🔙 Kembali", callback_data='manage_stores')]
+]
+LIST_MY_STORES_EMPTY_MARKUP = InlineKeyboardMarkup(LIST_MY_STORES_EMPTY_KEYBOARD)
+
+STORE_SEARCH_EMPTY_KEYBOARD = [
+    [InlineKeyboardButton("🔍 Cari Lagi", callback_data='search_stores')],
+    [InlineKeyboardButton("🔙 Kembali", callback_data='manage_stores')]
+]
+STORE_SEARCH_EMPTY_MARKUP = InlineKeyboardMarkup(STORE_SEARCH_EMPTY_KEYBOARD)
+
+# Message texts (static ones are sent as-is, *_TMPL ones are filled with str.format)
+WELCOME_TEXT = (
+    "👋 Selamat datang di Bot Monitor Sale Uniqlo!\n\n"
+    "Bot ini akan membantu Anda memantau produk Uniqlo yang sedang sale.\n\n"
+    "Fitur:\n"
+    "• ➕ Tambah produk untuk dipantau\n"
+    "• 📋 Lihat daftar produk yang dipantau\n"
+    "• 🏪 Kelola toko yang ingin dipantau\n"
+    "• 🔔 Notifikasi otomatis saat produk sale\n"
+    "• 📊 Info lengkap: nama, size, toko, harga sebelum & sesudah sale\n\n"
+    "Pilih menu di bawah:"
+)
+
+ADD_PRODUCT_PROMPT = (
+    "📝 **Tambah Produk Baru**\n\n"
+    "Silakan kirim link produk Uniqlo yang ingin dipantau.\n\n"
+    "Contoh:\n"
+    "`https://www.uniqlo.com/id/id/products/E479678-000/00`\n\n"
+    "Atau kirim /cancel untuk membatalkan."
+)
+
+SEARCH_STORES_PROMPT = (
+    "🔍 **Cari Toko**\n\n"
+    "Kirim nama kota untuk mencari toko Uniqlo di kota tersebut.\n\n"
+    "Contoh: `Surabaya`\n\n"
+    "Atau kirim /cancel untuk membatalkan."
+)
+
+PRODUCT_LIST_EMPTY_TEXT = (
+    "📋 **Daftar Produk**\n\n"
+    "Anda belum menambahkan produk untuk dipantau.\n\n"
+    "Klik '➕ Tambah Produk' untuk menambahkan produk."
+)
+
+STORE_LIST_EMPTY_TEXT = (
+    "📋 **Toko Saya**\n\n"
+    "Anda belum menambahkan toko untuk dipantau.\n\n"
+    "Klik 'Cari Toko' untuk menambahkan."
+)
+
+NO_PRODUCTS_TEXT = "📋 Anda belum menambahkan produk untuk dipantau."
+
+STARTUP_TMPL = (
+    "✅ **Bot Monitor Sale Uniqlo telah aktif!**\n\n"
+    "📦 **Produk yang dipantau ({n}):**\n"
+    "{lst}\n"
+    "🔄 Bot akan mengecek setiap {mins} menit.\n"
+    "🔔 Anda akan mendapat notifikasi saat produk sale.\n\n"
+    "⏰ {ts}"
+)
+
+# Telegram allows ~30 messages/second per bot; stay a bit below it for broadcasts
+telegram_limiter = RateLimiter(25, 1)
+
+# Per-user caches for menu navigation (invalidated on add/delete)
+user_products_cache = TTLCache(maxsize=10_000, ttl=60)
+user_stores_cache = TTLCache(maxsize=10_000, ttl=60)
+
+async def _cached_user_products(user_id: int) -> List[dict]:
+    """Get user's products, served from cache when fresh"""
+    products = user_products_cache.get(user_id)
+    if products is None:
+        products = await asyncio.to_thread(db.get_user_products, user_id)
+        user_products_cache.set(user_id, products)
+    return products
+
+async def _cached_user_stores(user_id: int) -> List[dict]:
+    """Get user's stores, served from cache when fresh"""
+    stores = user_stores_cache.get(user_id)
+    if stores is None:
+        stores = await asyncio.to_thread(db.get_user_stores, user_id)
+        user_stores_cache.set(user_id, stores)
+    return stores
+
+@functools.lru_cache(maxsize=4096)
+def _short_url(url: str) -> str:
+    """Shorten a product URL for display (part after /products/)"""
+    _, sep, tail = url.partition('/products/')
+    return tail if sep else url[:50]
+
+# Store metadata rarely changes; cache Uniqlo lookups for an hour
+store_search_cache = TTLCache(maxsize=256, ttl=3600)
+
+async def _store_info(store_id: str):
+    """Get store info from Uniqlo API, cached by store ID (cache lives on UniqloAPI)"""
+    store_info = api.store_info_cache.get(store_id)
+    if store_info is None:
+        store_info = await asyncio.to_thread(api.get_store_info, store_id)
+    return store_info
+
+async def _search_stores(city: str) -> List[dict]:
+    """Search stores by city from Uniqlo API, cached by normalized city name"""
+    key = city.strip().lower()
+    stores = store_search_cache.get(key)
+    if stores is None:
+        stores = await asyncio.to_thread(api.search_stores, city)
+        if stores:
+            store_search_cache.set(key, stores)
+    return stores
+
+# One lock per user: keeps each chat's updates ordered while other chats run concurrently.
+# Weak values let idle locks be garbage collected.
+_user_locks = weakref.WeakValueDictionary()
+
+def _user_lock(user_id: int) -> asyncio.Lock:
+    """Get (or create) the lock serializing updates for a user"""
+    lock = _user_locks.get(user_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _user_locks[user_id] = lock
+    return lock
+
+def _invalidate_user_cache(user_id: int):
+    """Drop cached products/stores after user's data changes"""
+    user_products_cache.pop(user_id, None)
+    user_stores_cache.pop(user_id, None)
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send a message when the command /start is issued."""
-    keyboard = [
-        [InlineKeyboardButton("➕ Tambah Produk", callback_data='add_product')],
-        [InlineKeyboardButton("📋 Daftar Produk", callback_data='list_products')],
-        [InlineKeyboardButton("🏪 Kelola Toko", callback_data='manage_stores')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    welcome_text = (
-        "👋 Selamat datang di Bot Monitor Sale Uniqlo!\n\n"
-        "Bot ini akan membantu Anda memantau produk Uniqlo yang sedang sale.\n\n"
-        "Fitur:\n"
-        "• ➕ Tambah produk untuk dipantau\n"
-        "• 📋 Lihat daftar produk yang dipantau\n"
-        "• 🏪 Kelola toko yang ingin dipantau\n"
-        "• 🔔 Notifikasi otomatis saat produk sale\n"
-        "• 📊 Info lengkap: nama, size, toko, harga sebelum & sesudah sale\n\n"
-        "Pilih menu di bawah:"
-    )
-    
     await update.message.reply_text(
-        welcome_text,
-        reply_markup=reply_markup
+        WELCOME_TEXT,
+        reply_markup=MAIN_MENU_MARKUP
     )
 
 async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -60,443 +200,385 @@ async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['waiting_for_city'] = False
     
     # Show main menu
-    keyboard = [
-        [InlineKeyboardButton("➕ Tambah Produk", callback_data='add_product')],
-        [InlineKeyboardButton("📋 Daftar Produk", callback_data='list_products')],
-        [InlineKeyboardButton("🏪 Kelola Toko", callback_data='manage_stores')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
     await update.message.reply_text(
         "❌ Operasi dibatalkan.\n\nPilih menu di bawah:",
-        reply_markup=reply_markup
+        reply_markup=MAIN_MENU_MARKUP
     )
 
 
-async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle button callbacks."""
-    query = update.callback_query
-    await query.answer()
-    
-    user_id = query.from_user.id
-    
-    if query.data == 'add_product':
+async def _show_product_list(query, context, user_id: int):
+    """Fetch and render the user's product list with delete buttons"""
+    products = await _cached_user_products(user_id)
+    # Keep the rendered rows so a delete can re-render without another query
+    context.user_data['product_list'] = products
+    await _render_product_list(query, products)
+
+async def _render_product_list(query, products: List[dict]):
+    """Render a product list with delete buttons"""
+    if not products:
         await query.edit_message_text(
-            "📝 **Tambah Produk Baru**\n\n"
-            "Silakan kirim link produk Uniqlo yang ingin dipantau.\n\n"
-            "Contoh:\n"
-            "`https://www.uniqlo.com/id/id/products/E479678-000/00`\n\n"
-            "Atau kirim /cancel untuk membatalkan.",
+            PRODUCT_LIST_EMPTY_TEXT,
             parse_mode=ParseMode.MARKDOWN
         )
-        context.user_data['waiting_for_url'] = True
-        
-    elif query.data == 'list_products':
-        products = db.get_user_products(user_id)
-        
-        if not products:
-            await query.edit_message_text(
-                "📋 **Daftar Produk**\n\n"
-                "Anda belum menambahkan produk untuk dipantau.\n\n"
-                "Klik '➕ Tambah Produk' untuk menambahkan produk.",
-                parse_mode=ParseMode.MARKDOWN
-            )
-        else:
-            text = "📋 **Daftar Produk yang Dipantau**\n\n"
-            keyboard = []
-            
-            for i, product in enumerate(products, 1):
-                product_name = product.get('product_name', 'Produk Tanpa Nama')
-                product_url = product['product_url']
-                # Shorten URL for display
-                short_url = product_url.split('/products/')[-1] if '/products/' in product_url else product_url[:50]
-                text += f"{i}. {product_name}\n   `{short_url}`\n\n"
-                keyboard.append([InlineKeyboardButton(
-                    f"❌ Hapus {i}",
-                    callback_data=f"delete_{product['id']}"
-                )])
-            
-            keyboard.append([InlineKeyboardButton("🔙 Kembali", callback_data='back_to_menu')])
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.edit_message_text(
-                text,
-                reply_markup=reply_markup,
-                parse_mode=ParseMode.MARKDOWN
-            )
+        return
     
-    elif query.data == 'back_to_menu':
-        keyboard = [
-            [InlineKeyboardButton("➕ Tambah Produk", callback_data='add_product')],
-            [InlineKeyboardButton("📋 Daftar Produk", callback_data='list_products')],
-            [InlineKeyboardButton("🏪 Kelola Toko", callback_data='manage_stores')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
+    parts = ["📋 **Daftar Produk yang Dipantau**\n\n"]
+    keyboard = []
+    
+    for i, product in enumerate(products, 1):
+        product_name = product.get('product_name', 'Produk Tanpa Nama')
+        # Shorten URL for display
+        short_url = _short_url(product['product_url'])
+        parts.append(f"{i}. {product_name}\n   `{short_url}`\n\n")
+        keyboard.append([InlineKeyboardButton(
+            f"❌ Hapus {i}",
+            callback_data=f"delete_{product['id']}"
+        )])
+    
+    keyboard.append([InlineKeyboardButton("🔙 Kembali", callback_data='back_to_menu')])
+    
+    await query.edit_message_text(
+        "".join(parts),
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode=ParseMode.MARKDOWN
+    )
+
+async def _show_store_list(query, context, user_id: int):
+    """Fetch and render the user's monitored stores with remove buttons"""
+    user_stores = await _cached_user_stores(user_id)
+    context.user_data['store_list'] = user_stores
+    await _render_store_list(query, user_stores)
+
+async def _render_store_list(query, user_stores: List[dict]):
+    """Render a store list with remove buttons"""
+    if not user_stores:
         await query.edit_message_text(
-            "👋 **Menu Utama**\n\nPilih menu di bawah:",
-            reply_markup=reply_markup,
+            STORE_LIST_EMPTY_TEXT,
+            reply_markup=LIST_MY_STORES_EMPTY_MARKUP,
             parse_mode=ParseMode.MARKDOWN
         )
+        return
     
-    elif query.data == 'manage_stores':
-        user_stores = db.get_user_stores(user_id)
-        
-        keyboard = [
-            [InlineKeyboardButton("🔍 Cari Toko", callback_data='search_stores')],
-            [InlineKeyboardButton("📋 Toko Saya", callback_data='list_my_stores')],
-            [InlineKeyboardButton("🔙 Kembali", callback_data='back_to_menu')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        store_count = len(user_stores)
+    parts = ["📋 **Toko yang Dipantau**\n\n"]
+    keyboard = []
+    
+    for i, store in enumerate(user_stores, 1):
+        store_name = store.get('store_name', f"Store {store['store_id']}")
+        parts.append(f"{i}. {store_name}\n   ID: `{store['store_id']}`\n\n")
+        keyboard.append([InlineKeyboardButton(
+            f"❌ Hapus {i}",
+            callback_data=f"remove_store_{store['store_id']}"
+        )])
+    
+    keyboard.append([InlineKeyboardButton("🔙 Kembali", callback_data='manage_stores')])
+    
+    await query.edit_message_text(
+        "".join(parts),
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode=ParseMode.MARKDOWN
+    )
+
+async def _on_add_product(query, context, user_id: int, arg: str):
+    await query.edit_message_text(
+        ADD_PRODUCT_PROMPT,
+        parse_mode=ParseMode.MARKDOWN
+    )
+    context.user_data['waiting_for_url'] = True
+
+async def _on_list_products(query, context, user_id: int, arg: str):
+    await _show_product_list(query, context, user_id)
+
+async def _on_back_to_menu(query, context, user_id: int, arg: str):
+    await query.edit_message_text(
+        "👋 **Menu Utama**\n\nPilih menu di bawah:",
+        reply_markup=MAIN_MENU_MARKUP,
+        parse_mode=ParseMode.MARKDOWN
+    )
+
+async def _on_manage_stores(query, context, user_id: int, arg: str):
+    store_count = len(await _cached_user_stores(user_id))
+    await query.edit_message_text(
+        "🏪 **Kelola Toko**\n\n"
+        f"Anda memantau **{store_count} toko**.\n\n"
+        "Pilih menu:",
+        reply_markup=MANAGE_STORES_MARKUP,
+        parse_mode=ParseMode.MARKDOWN
+    )
+
+async def _on_search_stores(query, context, user_id: int, arg: str):
+    await query.edit_message_text(
+        SEARCH_STORES_PROMPT,
+        parse_mode=ParseMode.MARKDOWN
+    )
+    context.user_data['waiting_for_city'] = True
+
+async def _on_list_my_stores(query, context, user_id: int, arg: str):
+    await _show_store_list(query, context, user_id)
+
+async def _on_add_store(query, context, user_id: int, store_id: str):
+    # Get store info
+    store_info = await _store_info(store_id)
+    store_name = store_info.get('name', f'Store {store_id}') if store_info else f'Store {store_id}'
+    
+    # Add to user's stores
+    added = await asyncio.to_thread(db.add_user_store, user_id, store_id, store_name)
+    _invalidate_user_cache(user_id)
+    context.user_data.pop('store_list', None)
+    
+    if added:
+        await query.answer("✅ Toko berhasil ditambahkan!", show_alert=True)
         await query.edit_message_text(
-            "🏪 **Kelola Toko**\n\n"
-            f"Anda memantau **{store_count} toko**.\n\n"
-            "Pilih menu:",
-            reply_markup=reply_markup,
+            f"✅ **Toko Berhasil Ditambahkan!**\n\n"
+            f"🏪 {store_name}\n"
+            f"🆔 Store ID: `{store_id}`\n\n"
+            f"Bot akan memantau produk di toko ini.",
             parse_mode=ParseMode.MARKDOWN
         )
+    else:
+        await query.answer("⚠️ Toko sudah ada dalam daftar!", show_alert=True)
+
+async def _on_remove_store(query, context, user_id: int, store_id: str):
+    deleted = await asyncio.to_thread(db.delete_user_store, user_id, store_id)
     
-    elif query.data == 'search_stores':
-        await query.edit_message_text(
-            "🔍 **Cari Toko**\n\n"
-            "Kirim nama kota untuk mencari toko Uniqlo di kota tersebut.\n\n"
-            "Contoh: `Surabaya`\n\n"
-            "Atau kirim /cancel untuk membatalkan.",
-            parse_mode=ParseMode.MARKDOWN
+    if not deleted:
+        _invalidate_user_cache(user_id)
+        return
+    
+    await query.answer("✅ Toko berhasil dihapus!", show_alert=True)
+    shown = context.user_data.get('store_list')
+    if shown is None:
+        _invalidate_user_cache(user_id)
+        await _show_store_list(query, context, user_id)
+        return
+    
+    # Drop just the removed row from the list already on screen
+    remaining = [s for s in shown if s['store_id'] != store_id]
+    context.user_data['store_list'] = remaining
+    user_stores_cache.set(user_id, remaining)
+    await _render_store_list(query, remaining)
+
+async def _on_delete_product(query, context, user_id: int, product_id: str):
+    product_id = int(product_id)
+    deleted = await asyncio.to_thread(db.delete_product, user_id, product_id)
+    
+    if not deleted:
+        _invalidate_user_cache(user_id)
+        return
+    
+    await query.answer("✅ Produk berhasil dihapus!", show_alert=True)
+    shown = context.user_data.get('product_list')
+    if shown is None:
+        _invalidate_user_cache(user_id)
+        await _show_product_list(query, context, user_id)
+        return
+    
+    # Drop just the deleted row from the list already on screen
+    remaining = [p for p in shown if p['id'] != product_id]
+    context.user_data['product_list'] = remaining
+    user_products_cache.set(user_id, remaining)
+    await _render_product_list(query, remaining)
+
+# Callback dispatch: exact callback_data first, then "<action>_<arg>" by action prefix
+CALLBACK_HANDLERS = {
+    'add_product': _on_add_product,
+    'list_products': _on_list_products,
+    'back_to_menu': _on_back_to_menu,
+    'manage_stores': _on_manage_stores,
+    'search_stores': _on_search_stores,
+    'list_my_stores': _on_list_my_stores,
+}
+CALLBACK_PREFIX_HANDLERS = {
+    'add_store': _on_add_store,
+    'remove_store': _on_remove_store,
+    'delete': _on_delete_product,
+}
+
+async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle button callbacks."""
+    query = update.callback_query
+    await query.answer()
+    
+    user_id = query.from_user.id
+    
+    handler = CALLBACK_HANDLERS.get(query.data)
+    arg = ''
+    if handler is None:
+        # IDs never contain '_', so the last '_' splits action from argument
+        action, _, arg = query.data.rpartition('_')
+        handler = CALLBACK_PREFIX_HANDLERS.get(action)
+        if handler is None:
+            logger.warning("Unknown callback data: %s", query.data)
+            return
+    
+    async with _user_lock(user_id):
+        await handler(query, context, user_id, arg)
+
+async def _run_initial_check(update: Update, context: ContextTypes.DEFAULT_TYPE, db_id: int, user_id: int):
+    """Check a newly added product; notification is sent by monitor.py"""
+    try:
+        logger.debug("Running initial check for product %s", db_id)
+        result = await monitor.check_product(db_id, user_id, context.bot)
+        logger.debug("Initial check result: %s", result)
+    except Exception:
+        logger.exception("Initial check failed for product %s", db_id)
+        await update.message.reply_text(
+            "⚠️ Produk berhasil ditambahkan, tapi terjadi error saat pengecekan awal.\n"
+            "Bot akan tetap memantau produk ini secara berkala."
         )
-        context.user_data['waiting_for_city'] = True
+
+async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle text messages."""
+    user_id = update.message.from_user.id
+    text = update.message.text
     
-    elif query.data == 'list_my_stores':
-        user_stores = db.get_user_stores(user_id)
-        
-        if not user_stores:
-            keyboard = [
-                [InlineKeyboardButton("🔍 Cari Toko", callback_data='search_stores')],
-                [InlineKeyboardButton("🔙 Kembali", callback_data='manage_stores')]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+    async with _user_lock(user_id):
+        # Check if user is waiting to search stores by city
+        if context.user_data.get('waiting_for_city'):
+            if text.lower() == '/cancel':
+                context.user_data['waiting_for_city'] = False
+                await update.message.reply_text(
+                    "❌ Pencarian dibatalkan.\n\nPilih menu di bawah:",
+                    reply_markup=MAIN_MENU_MARKUP
+                )
+                return
             
-            await query.edit_message_text(
-                "📋 **Toko Saya**\n\n"
-                "Anda belum menambahkan toko untuk dipantau.\n\n"
-                "Klik 'Cari Toko' untuk menambahkan.",
-                reply_markup=reply_markup,
+            # Search stores by city
+            await update.message.reply_text(
+                f"🔍 Mencari toko Uniqlo di **{text}**...\n"
+                "Mohon tunggu sebentar...",
                 parse_mode=ParseMode.MARKDOWN
             )
-        else:
-            text = "📋 **Toko yang Dipantau**\n\n"
-            keyboard = []
-            
-            for i, store in enumerate(user_stores, 1):
-                store_name = store.get('store_name', f"Store {store['store_id']}")
-                text += f"{i}. {store_name}\n   ID: `{store['store_id']}`\n\n"
-                keyboard.append([InlineKeyboardButton(
-                    f"❌ Hapus {i}",
-                    callback_data=f"remove_store_{store['store_id']}"
-                )])
             
-            keyboard.append([InlineKeyboardButton("🔙 Kembali", callback_data='manage_stores')])
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.edit_message_text(
-                text,
-                reply_markup=reply_markup,
-                parse_mode=ParseMode.MARKDOWN
-            )
-    
-    elif query.data.startswith('add_store_'):
-        store_id = query.data.replace('add_store_', '')
-        
-        # Get store info
-        store_info = api.get_store_info(store_id)
-        store_name = store_info.get('name', f'Store {store_id}') if store_info else f'Store {store_id}'
-        
-        # Add to user's stores
-        added = db.add_user_store(user_id, store_id, store_name)
-        
-        if added:
-            await query.answer("✅ Toko berhasil ditambahkan!", show_alert=True)
-            await query.edit_message_text(
-                f"✅ **Toko Berhasil Ditambahkan!**\n\n"
-                f"🏪 {store_name}\n"
-                f"🆔 Store ID: `{store_id}`\n\n"
-                f"Bot akan memantau produk di toko ini.",
-                parse_mode=ParseMode.MARKDOWN
-            )
-        else:
-            await query.answer("⚠️ Toko sudah ada dalam daftar!", show_alert=True)
-    
-    elif query.data.startswith('remove_store_'):
-        store_id = query.data.replace('remove_store_', '')
-        deleted = db.delete_user_store(user_id, store_id)
-        
-        if deleted:
-            await query.answer("✅ Toko berhasil dihapus!", show_alert=True)
-            # Refresh list
-            user_stores = db.get_user_stores(user_id)
+            stores = await _search_stores(text)
+            context.user_data['waiting_for_city'] = False
             
-            if not user_stores:
-                keyboard = [
-                    [InlineKeyboardButton("🔍 Cari Toko", callback_data='search_stores')],
-                    [InlineKeyboardButton("🔙 Kembali", callback_data='manage_stores')]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await query.edit_message_text(
-                    "📋 **Toko Saya**\n\n"
-                    "Anda belum menambahkan toko untuk dipantau.",
-                    reply_markup=reply_markup,
+            if not stores:
+                await update.message.reply_text(
+                    f"❌ Tidak ditemukan toko di **{text}**.\n\n"
+                    "Coba dengan nama kota lain.",
+                    reply_markup=STORE_SEARCH_EMPTY_MARKUP,
                     parse_mode=ParseMode.MARKDOWN
                 )
             else:
-                # Rebuild list
-                text = "📋 **Toko yang Dipantau**\n\n"
+                parts = [f"🏪 **Ditemukan {len(stores)} toko di {text}**\n\n"]
                 keyboard = []
                 
-                for i, store in enumerate(user_stores, 1):
-                    store_name = store.get('store_name', f"Store {store['store_id']}")
-                    text += f"{i}. {store_name}\n   ID: `{store['store_id']}`\n\n"
+                for i, store in enumerate(stores, 1):
+                    store_id = store.get('id', '')
+                    store_name = store.get('name', f'Store {store_id}')
+                    store_address = store.get('address', 'No address')
+                    
+                    parts.append(f"{i}. **{store_name}**\n")
+                    parts.append(f"   📍 {store_address}\n")
+                    parts.append(f"   🆔 `{store_id}`\n\n")
+                    
                     keyboard.append([InlineKeyboardButton(
-                        f"❌ Hapus {i}",
-                        callback_data=f"remove_store_{store['store_id']}"
+                        f"➕ Tambah {i}",
+                        callback_data=f"add_store_{store_id}"
                     )])
                 
                 keyboard.append([InlineKeyboardButton("🔙 Kembali", callback_data='manage_stores')])
                 reply_markup = InlineKeyboardMarkup(keyboard)
                 
-                await query.edit_message_text(
-                    text,
-                    reply_markup=reply_markup,
-                    parse_mode=ParseMode.MARKDOWN
-                )
-    
-    elif query.data.startswith('delete_'):
-        product_id = int(query.data.split('_')[1])
-        deleted = db.delete_product(user_id, product_id)
-        
-        if deleted:
-            await query.answer("✅ Produk berhasil dihapus!", show_alert=True)
-            # Refresh list
-            products = db.get_user_products(user_id)
-            if not products:
-                await query.edit_message_text(
-                    "📋 **Daftar Produk**\n\n"
-                    "Anda belum menambahkan produk untuk dipantau.",
-                    parse_mode=ParseMode.MARKDOWN
-                )
-            else:
-                # Rebuild list
-                text = "📋 **Daftar Produk yang Dipantau**\n\n"
-                keyboard = []
-                for i, product in enumerate(products, 1):
-                    product_name = product.get('product_name', 'Produk Tanpa Nama')
-                    product_url = product['product_url']
-                    short_url = product_url.split('/products/')[-1] if '/products/' in product_url else product_url[:50]
-                    text += f"{i}. {product_name}\n   `{short_url}`\n\n"
-                    keyboard.append([InlineKeyboardButton(
-                        f"❌ Hapus {i}",
-                        callback_data=f"delete_{product['id']}"
-                    )])
-                keyboard.append([InlineKeyboardButton("🔙 Kembali", callback_data='back_to_menu')])
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await query.edit_message_text(
-                    text,
+                await update.message.reply_text(
+                    "".join(parts),
                     reply_markup=reply_markup,
                     parse_mode=ParseMode.MARKDOWN
                 )
-
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle text messages."""
-    user_id = update.message.from_user.id
-    text = update.message.text
-    
-    # Check if user is waiting to search stores by city
-    if context.user_data.get('waiting_for_city'):
-        if text.lower() == '/cancel':
-            context.user_data['waiting_for_city'] = False
-            keyboard = [
-                [InlineKeyboardButton("➕ Tambah Produk", callback_data='add_product')],
-                [InlineKeyboardButton("📋 Daftar Produk", callback_data='list_products')],
-                [InlineKeyboardButton("🏪 Kelola Toko", callback_data='manage_stores')]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await update.message.reply_text(
-                "❌ Pencarian dibatalkan.\n\nPilih menu di bawah:",
-                reply_markup=reply_markup
-            )
             return
         
-        # Search stores by city
-        await update.message.reply_text(
-            f"🔍 Mencari toko Uniqlo di **{text}**...\n"
-            "Mohon tunggu sebentar...",
-            parse_mode=ParseMode.MARKDOWN
-        )
-        
-        stores = api.search_stores(text)
-        context.user_data['waiting_for_city'] = False
-        
-        if not stores:
-            keyboard = [
-                [InlineKeyboardButton("🔍 Cari Lagi", callback_data='search_stores')],
-                [InlineKeyboardButton("🔙 Kembali", callback_data='manage_stores')]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+        # Check if user is waiting to add a product
+        if context.user_data.get('waiting_for_url'):
+            if text.lower() == '/cancel':
+                context.user_data['waiting_for_url'] = False
+                # Return to main menu
+                await update.message.reply_text(
+                    "❌ Penambahan produk dibatalkan.\n\nPilih menu di bawah:",
+                    reply_markup=MAIN_MENU_MARKUP
+                )
+                return
             
-            await update.message.reply_text(
-                f"❌ Tidak ditemukan toko di **{text}**.\n\n"
-                "Coba dengan nama kota lain.",
-                reply_markup=reply_markup,
-                parse_mode=ParseMode.MARKDOWN
-            )
-        else:
-            message_text = f"🏪 **Ditemukan {len(stores)} toko di {text}**\n\n"
-            keyboard = []
+            # Validate URL and extract product ID in a single pass
+            match = PRODUCT_URL_RE.search(text)
+            if match is None:
+                await update.message.reply_text(
+                    "❌ URL tidak valid. Pastikan URL adalah link produk Uniqlo.\n\n"
+                    "Contoh: https://www.uniqlo.com/id/id/products/E479678-000/00\n\n"
+                    "Kirim /cancel untuk membatalkan."
+                )
+                return
             
-            for i, store in enumerate(stores, 1):
-                store_id = store.get('id', '')
-                store_name = store.get('name', f'Store {store_id}')
-                store_address = store.get('address', 'No address')
-                
-                message_text += f"{i}. **{store_name}**\n"
-                message_text += f"   📍 {store_address}\n"
-                message_text += f"   🆔 `{store_id}`\n\n"
-                
-                keyboard.append([InlineKeyboardButton(
-                    f"➕ Tambah {i}",
-                    callback_data=f"add_store_{store_id}"
-                )])
+            product_id = match.group(1)
+            if not product_id:
+                await update.message.reply_text(
+                    "❌ Tidak dapat mengekstrak ID produk dari URL.\n"
+                    "Pastikan URL valid dan coba lagi.\n\n"
+                    "Kirim /cancel untuk membatalkan."
+                )
+                return
             
-            keyboard.append([InlineKeyboardButton("🔙 Kembali", callback_data='manage_stores')])
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            # Get product name
+            product_name = await asyncio.to_thread(api.get_product_name_from_url, text)
+            if not product_name:
+                product_name = f"Produk {product_id}"
             
-            await update.message.reply_text(
-                message_text,
-                reply_markup=reply_markup,
-                parse_mode=ParseMode.MARKDOWN
-            )
-        return
-    
-    # Check if user is waiting to add a product
-    if context.user_data.get('waiting_for_url'):
-        if text.lower() == '/cancel':
-            context.user_data['waiting_for_url'] = False
-            # Return to main menu
-            keyboard = [
-                [InlineKeyboardButton("➕ Tambah Produk", callback_data='add_product')],
-                [InlineKeyboardButton("📋 Daftar Produk", callback_data='list_products')],
-                [InlineKeyboardButton("🏪 Kelola Toko", callback_data='manage_stores')]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await update.message.reply_text(
-                "❌ Penambahan produk dibatalkan.\n\nPilih menu di bawah:",
-                reply_markup=reply_markup
-            )
-            return
-        
-        # Validate URL
-        if not ('uniqlo.com' in text and '/products/' in text):
-            await update.message.reply_text(
-                "❌ URL tidak valid. Pastikan URL adalah link produk Uniqlo.\n\n"
-                "Contoh: https://www.uniqlo.com/id/id/products/E479678-000/00\n\n"
-                "Kirim /cancel untuk membatalkan."
-            )
-            return
-        
-        # Extract product ID
-        product_id = api.extract_product_id_from_url(text)
-        if not product_id:
-            await update.message.reply_text(
-                "❌ Tidak dapat mengekstrak ID produk dari URL.\n"
-                "Pastikan URL valid dan coba lagi.\n\n"
-                "Kirim /cancel untuk membatalkan."
-            )
-            return
-        
-        # Get product name
-        product_name = api.get_product_name_from_url(text)
-        if not product_name:
-            product_name = f"Produk {product_id}"
-        
-        # Add product to database
-        db_id = db.add_product(user_id, text, product_id, product_name)
-        
-        if db_id:
-            context.user_data['waiting_for_url'] = False
-            await update.message.reply_text(
-                f"✅ **Produk berhasil ditambahkan!**\n\n"
-                f"📦 **{product_name}**\n"
-                f"🔗 `{text}`\n\n"
-                f"Bot akan memantau produk ini dan mengirim notifikasi saat ada sale.\n"
-                f"Memeriksa status produk saat ini...",
-                parse_mode=ParseMode.MARKDOWN
-            )
+            # Add product to database
+            db_id = await asyncio.to_thread(db.add_product, user_id, text, product_id, product_name)
+            _invalidate_user_cache(user_id)
+            context.user_data.pop('product_list', None)
             
-            # Do initial check (monitor.py will send notification if product is on sale or out of stock)
-            try:
-                print(f"[DEBUG] Running initial check for product {db_id}...")
-                result = await monitor.check_product(db_id, user_id, context.bot)
-                print(f"[DEBUG] Initial check result: {result}")
-                
-                # Note: Notification is already sent by monitor.py for both sale and out-of-stock cases
-                # No need to send duplicate notification here
+            if db_id:
+                context.user_data['waiting_for_url'] = False
+                await update.message.reply_text(
+                    f"✅ **Produk berhasil ditambahkan!**\n\n"
+                    f"📦 **{product_name}**\n"
+                    f"🔗 `{text}`\n\n"
+                    f"Bot akan memantau produk ini dan mengirim notifikasi saat ada sale.\n"
+                    f"Memeriksa status produk saat ini...",
+                    parse_mode=ParseMode.MARKDOWN
+                )
                 
-                await asyncio.sleep(1)  # Small delay to ensure notification is sent
-            except Exception as e:
-                print(f"[ERROR] Error in initial check: {e}")
-                import traceback
-                traceback.print_exc()
+                # Do initial check in the background so the user gets the reply right away
+                # (monitor.py will send notification if product is on sale or out of stock)
+                context.application.create_task(
+                    _run_initial_check(update, context, db_id, user_id),
+                    update=update
+                )
+            else:
                 await update.message.reply_text(
-                    "⚠️ Produk berhasil ditambahkan, tapi terjadi error saat pengecekan awal.\n"
-                    "Bot akan tetap memantau produk ini secara berkala."
+                    "⚠️ Produk ini sudah ada dalam daftar pemantauan Anda."
                 )
         else:
+            # Regular message - show menu
             await update.message.reply_text(
-                "⚠️ Produk ini sudah ada dalam daftar pemantauan Anda."
+                "Pilih menu di bawah:",
+                reply_markup=MAIN_MENU_MARKUP
             )
-    else:
-        # Regular message - show menu
-        keyboard = [
-            [InlineKeyboardButton("➕ Tambah Produk", callback_data='add_product')],
-            [InlineKeyboardButton("📋 Daftar Produk", callback_data='list_products')],
-            [InlineKeyboardButton("🏪 Kelola Toko", callback_data='manage_stores')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await update.message.reply_text(
-            "Pilih menu di bawah:",
-            reply_markup=reply_markup
-        )
 
 async def list_products(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """List all products being monitored."""
     user_id = update.message.from_user.id
-    products = db.get_user_products(user_id)
+    products = await _cached_user_products(user_id)
     
     if not products:
         await update.message.reply_text(
-            "📋 Anda belum menambahkan produk untuk dipantau.\n\n"
-            "Gunakan /add untuk menambahkan produk."
+            NO_PRODUCTS_TEXT + "\n\nGunakan /add untuk menambahkan produk."
         )
     else:
-        text = "📋 **Daftar Produk yang Dipantau**\n\n"
+        parts = ["📋 **Daftar Produk yang Dipantau**\n\n"]
         for i, product in enumerate(products, 1):
             product_name = product.get('product_name', 'Produk Tanpa Nama')
-            text += f"{i}. {product_name}\n"
+            parts.append(f"{i}. {product_name}\n")
         
-        await update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN)
+        await update.message.reply_text("".join(parts), parse_mode=ParseMode.MARKDOWN)
 
 async def check_products(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Manually check all products for sales."""
     user_id = update.message.from_user.id
-    products = db.get_user_products(user_id)
+    products = await _cached_user_products(user_id)
     
     if not products:
-        await update.message.reply_text(
-            "📋 Anda belum menambahkan produk untuk dipantau."
-        )
+        await update.message.reply_text(NO_PRODUCTS_TEXT)
         return
     
     await update.message.reply_text(
@@ -504,14 +586,20 @@ async def check_products(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "Mohon tunggu sebentar..."
     )
     
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_CHECKS)
+    user_store_ids = await asyncio.to_thread(db.get_all_user_store_ids, user_id)
+    
+    async def check_one(product):
+        async with semaphore:
+            return await monitor.check_product(product['id'], user_id, context.bot, product, user_store_ids)
+    
+    results = await asyncio.gather(*[check_one(product) for product in products], return_exceptions=True)
     checked = 0
-    for product in products:
-        try:
-            await monitor.check_product(product['id'], user_id, context.bot)
+    for product, result in zip(products, results):
+        if isinstance(result, Exception):
+            logger.error("Error checking product %s: %s", product['id'], result)
+        else:
             checked += 1
-            await asyncio.sleep(1)  # Small delay between checks
-        except Exception as e:
-            print(f"Error checking product {product['id']}: {e}")
     
     await update.message.reply_text(
         f"✅ Selesai memeriksa {checked} produk.\n"
@@ -523,7 +611,7 @@ async def reset_notifications(update: Update, context: ContextTypes.DEFAULT_TYPE
     user_id = update.message.from_user.id
     
     # Reset notifications for today
-    deleted = db.reset_today_notifications()
+    deleted = await asyncio.to_thread(db.reset_today_notifications)
     
     await update.message.reply_text(
         f"✅ **Notifikasi hari ini telah direset!**\n\n"
@@ -531,90 +619,71 @@ async def reset_notifications(update: Update, context: ContextTypes.DEFAULT_TYPE
         f"🔔 Bot akan mengirim notifikasi lagi jika produk sale."
     )
 
-# Global flag to prevent duplicate startup notifications
-_startup_notification_sent = False
-
 async def send_startup_notification(application):
     """Send startup notification to all users with monitored products and check products immediately"""
-    global _startup_notification_sent
-    
-    # Prevent duplicate notifications if function is called multiple times
-    if _startup_notification_sent:
-        print("Startup notification already sent, skipping...")
+    # Prevent duplicate notifications across restarts (one broadcast per day, stored in SQLite)
+    if await asyncio.to_thread(db.has_sent_startup_today):
+        logger.debug("Startup notification already sent, skipping")
         return
     
     try:
-        # Get all unique users who have products
-        all_products = db.get_all_products()
-        
-        if not all_products:
-            print("Tidak ada produk yang dipantau. Bot siap menerima produk baru.")
-            _startup_notification_sent = True
-            return
-        
-        # Group products by user_id (ensure unique users)
-        user_products = {}
-        for product in all_products:
-            user_id = product['user_id']
-            if user_id not in user_products:
-                user_products[user_id] = []
-            user_products[user_id].append(product)
-        
         bot = application.bot
+        # Shared across users: caps concurrent product checks for the whole broadcast
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_CHECKS)
+        
+        async def check_one(product, user_id, user_store_ids):
+            async with semaphore:
+                return await monitor.check_product(product['id'], user_id, bot, product, user_store_ids)
         
-        # Send notification to each user ONCE and check products
-        for user_id, products in user_products.items():
+        async def notify_user(user_id, products):
             try:
-                # Remove duplicates by product_id
-                unique_products = {}
-                for product in products:
-                    prod_id = product.get('id')
-                    if prod_id and prod_id not in unique_products:
-                        unique_products[prod_id] = product
-                
-                products = list(unique_products.values())
-                
-                product_list = ""
+                product_lines = []
                 for i, product in enumerate(products, 1):
                     product_name = product.get('product_name', 'Produk Tanpa Nama')
-                    product_list += f"{i}. {product_name}\n"
+                    product_lines.append(f"{i}. {product_name}\n")
+                product_list = "".join(product_lines)
                 
-                message = (
-                    "✅ **Bot Monitor Sale Uniqlo telah aktif!**\n\n"
-                    f"📦 **Produk yang dipantau ({len(products)}):**\n"
-                    f"{product_list}\n"
-                    f"🔄 Bot akan mengecek setiap {CHECK_INTERVAL_MINUTES} menit.\n"
-                    f"🔔 Anda akan mendapat notifikasi saat produk sale.\n\n"
-                    f"⏰ {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}"
+                message = STARTUP_TMPL.format(
+                    n=len(products),
+                    lst=product_list,
+                    mins=CHECK_INTERVAL_MINUTES,
+                    ts=datetime.now().strftime('%d/%m/%Y %H:%M:%S')
                 )
                 
-                await bot.send_message(
-                    chat_id=user_id,
-                    text=message,
-                    parse_mode=ParseMode.MARKDOWN
-                )
+                async with telegram_limiter:
+                    await bot.send_message(
+                        chat_id=user_id,
+                        text=message,
+                        parse_mode=ParseMode.MARKDOWN
+                    )
                 
                 # Immediately check all products for this user
-                print(f"Checking {len(products)} products for user {user_id}...")
-                for product in products:
-                    try:
-                        await monitor.check_product(product['id'], user_id, bot)
-                        await asyncio.sleep(1)  # Small delay between checks
-                    except Exception as e:
-                        print(f"Error checking product {product['id']}: {e}")
-                
-                # Small delay between users
-                await asyncio.sleep(0.5)
-                
-            except Exception as e:
-                print(f"Error sending startup notification to user {user_id}: {e}")
+                logger.debug("Checking %d products for user %s", len(products), user_id)
+                user_store_ids = await asyncio.to_thread(db.get_all_user_store_ids, user_id)
+                results = await asyncio.gather(
+                    *[check_one(product, user_id, user_store_ids) for product in products],
+                    return_exceptions=True
+                )
+                for product, result in zip(products, results):
+                    if isinstance(result, Exception):
+                        logger.error("Error checking product %s: %s", product['id'], result)
+            except Exception:
+                logger.exception("Error sending startup notification to user %s", user_id)
+        
+        # Send notification to each user ONCE and check products (grouped by SQLite)
+        user_groups = await asyncio.to_thread(lambda: list(db.iter_products_grouped_by_user()))
+        await asyncio.gather(*[notify_user(user_id, products) for user_id, products in user_groups])
         
-        _startup_notification_sent = True
-        print(f"Startup notification sent and products checked for {len(user_products)} user(s)")
+        await asyncio.to_thread(db.mark_startup_sent_today)
         
-    except Exception as e:
-        print(f"Error in send_startup_notification: {e}")
-        _startup_notification_sent = True  # Set flag even on error to prevent retry loops
+        if not user_groups:
+            logger.info("No monitored products; bot is ready for new products")
+            return
+        
+        logger.info("Startup notification sent and products checked for %d user(s)", len(user_groups))
+        
+    except Exception:
+        logger.exception("Error in send_startup_notification")
 
 def main():
     """Start the bot."""
@@ -624,33 +693,52 @@ def main():
         return
     
     # Create application
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    # Process updates concurrently so a slow product check doesn't block other chats,
+    # with a larger HTTP pool so concurrent sends don't exhaust connections
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(True)
+        .connection_pool_size(256)
+        .pool_timeout(30)
+        .get_updates_pool_timeout(30)
+        .build()
+    )
     
     # Register handlers
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("list", list_products))
-    application.add_handler(CommandHandler("check", check_products))
-    application.add_handler(CommandHandler("reset", reset_notifications))
-    application.add_handler(CommandHandler("cancel", cancel_command))
-    application.add_handler(CallbackQueryHandler(button_handler))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-    
-    # Start monitoring task
-    monitor.start_monitoring(application)
+    application.add_handler(CommandHandler("start", start, block=False))
+    application.add_handler(CommandHandler("list", list_products, block=False))
+    application.add_handler(CommandHandler("check", check_products, block=False))
+    application.add_handler(CommandHandler("reset", reset_notifications, block=False))
+    application.add_handler(CommandHandler("cancel", cancel_command, block=False))
+    application.add_handler(CallbackQueryHandler(button_handler, block=False))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message, block=False))
     
     # Setup post_init hook (startup notification disabled per user request)
     async def post_init(app: Application):
         """Run after bot is initialized"""
+        # Start monitoring task (needs the running event loop)
+        monitor.start_monitoring(app)
         await asyncio.sleep(1)  # Small delay to ensure bot is ready
         print("Bot sedang berjalan...")
         print("Bot siap menerima perintah!")
         # Note: Startup notification disabled - notifications only sent when adding new products
     
+    async def post_shutdown(app: Application):
+        """Stop monitoring and release pooled Uniqlo API connections"""
+        await monitor.stop_monitoring()
+        api.close()
+    
     application.post_init = post_init
+    application.post_shutdown = post_shutdown
     
     # Run bot
     print("Memulai bot...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    log_listener.start()
+    try:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
+    finally:
+        log_listener.stop()  # Flush queued records before exit
 
 if __name__ == '__main__':
     main()
@@ -12,9 +12,15 @@ UNIQLO_API_BASE = 'https://www.uniqlo.com/id/api/commerce/v5/id'
 
 # Database Configuration
 DATABASE_FILE = 'uniqlo_monitor.db'
+PRICE_HISTORY_RETENTION_DAYS = 30  # Delete price history older than this
 
 # Monitoring Configuration
 CHECK_INTERVAL_MINUTES = 30  # Check every 30 minutes
+MAX_CONCURRENT_CHECKS = 5  # Max product checks running at the same time
+MAX_CONCURRENT_STORE_FETCHES = 8  # Max per-store product fetches in flight
+UNIQLO_API_RATE_PER_SECOND = 10  # Max Uniqlo API requests per second (all checks combined)
+API_MAX_RETRIES = 3  # Retries for a Uniqlo API request answered with 429/5xx
+API_MAX_RETRY_DELAY = 30  # Cap (seconds) on a single retry wait, including Retry-After
 
 # Store IDs to monitor (add more store IDs as needed)
 STORE_IDS = [
@@ -1,141 +1,504 @@
 import sqlite3
 import json
-from datetime import datetime
-from typing import List, Dict, Optional
+import queue
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from itertools import groupby
+from typing import List, Dict, Optional, Iterator, Tuple
+
+from models import Variant
+
+# Bump when init_database gains new tables, indexes or migrations
+SCHEMA_VERSION = 4
+
+# Hot-path statements, kept as module constants so sqlite3's per-connection
+# statement cache (cached_statements) reuses the compiled form on every call
+_SQL_PRODUCT_BY_ID = '''
+    SELECT id, user_id, product_url, product_id, product_name
+    FROM products
+    WHERE id = ?
+'''
+
+_SQL_SAVE_PRICE = '''
+    INSERT INTO price_history
+    (product_id, l2_id, size_code, color_code, store_id, store_name, base_price, promo_price, is_on_sale)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+_SQL_SAVE_PRICE_AT = '''
+    INSERT INTO price_history
+    (product_id, l2_id, size_code, color_code, store_id, store_name, base_price, promo_price, is_on_sale, checked_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+_SQL_LAST_PRICE = '''
+    SELECT base_price, promo_price, is_on_sale, checked_at
+    FROM price_history
+    WHERE product_id = ? AND l2_id = ? AND size_code = ?
+    ORDER BY checked_at DESC
+    LIMIT 1
+'''
+
+_SQL_HAS_NOTIFICATION = '''
+    SELECT EXISTS(
+        SELECT 1 FROM notifications_sent
+        WHERE product_id = ? AND l2_id = ? AND size_code = ?
+    )
+'''
+
+_SQL_MARK_NOTIFICATION = '''
+    INSERT OR REPLACE INTO notifications_sent (product_id, l2_id, size_code)
+    VALUES (?, ?, ?)
+'''
+
+_SQL_CLEAR_NOTIFICATION = '''
+    DELETE FROM notifications_sent
+    WHERE product_id = ? AND l2_id = ? AND size_code = ?
+'''
+
+_SQL_HAS_PRICE_HISTORY = '''
+    SELECT EXISTS(
+        SELECT 1 FROM price_history
+        WHERE product_id = ?
+    )
+'''
+
+# Per-product check summary kept on the products row (history only stores changes):
+# check_count is capped at 2, prev_on_sale is the check before last_on_sale
+_SQL_WAS_ON_SALE = '''
+    SELECT check_count >= 2 AND prev_on_sale
+    FROM products
+    WHERE id = ?
+'''
+
+_SQL_PRODUCT_CHECK_STATE = '''
+    SELECT
+        p.check_count,
+        p.prev_on_sale,
+        n.consecutive_days,
+        n.last_promo_price,
+        n.notified_day
+    FROM products p
+    LEFT JOIN product_notifications n ON n.product_id = p.id
+    WHERE p.id = ?
+'''
+
+_SQL_RECORD_PRODUCT_CHECK = '''
+    UPDATE products SET
+        prev_on_sale = last_on_sale,
+        last_on_sale = ?,
+        check_count = MIN(check_count + 1, 2),
+        last_checked_at = ?
+    WHERE id = ?
+'''
+
+# Newest stored row for each (l2_id, store_id) of a product
+_SQL_LATEST_VARIANT_PRICES = '''
+    SELECT l2_id, store_id, base_price, promo_price, is_on_sale
+    FROM (
+        SELECT l2_id, store_id, base_price, promo_price, is_on_sale,
+            ROW_NUMBER() OVER (PARTITION BY l2_id, store_id ORDER BY checked_at DESC, id DESC) AS rn
+        FROM price_history
+        WHERE product_id = ?
+    )
+    WHERE rn = 1
+'''
+
+_SQL_NOTIFICATION_ROW = '''
+    SELECT notified_at, last_promo_price, consecutive_days, notified_day
+    FROM product_notifications
+    WHERE product_id = ?
+'''
+
+_SQL_RESTORE_PRODUCT_NOTIFICATION = '''
+    INSERT OR REPLACE INTO product_notifications
+    (product_id, notified_at, last_promo_price, consecutive_days, notified_day)
+    VALUES (?, ?, ?, ?, ?)
+'''
+
+_SQL_NOTIFICATION_INFO = '''
+    SELECT consecutive_days, last_promo_price, notified_day
+    FROM product_notifications
+    WHERE product_id = ?
+'''
+
+# Consecutive-day counter is computed from the stored row: +1 when last notified
+# yesterday at the same price, otherwise restart at 1
+_SQL_UPSERT_PRODUCT_NOTIFICATION = '''
+    INSERT INTO product_notifications
+    (product_id, notified_at, last_promo_price, consecutive_days, notified_day)
+    VALUES (:product_id, CURRENT_TIMESTAMP, :promo_price, 1, :today)
+    ON CONFLICT(product_id) DO UPDATE SET
+        consecutive_days = CASE
+            WHEN notified_day = :yesterday AND last_promo_price = excluded.last_promo_price
+            THEN COALESCE(consecutive_days, 1) + 1
+            ELSE 1
+        END,
+        notified_at = CURRENT_TIMESTAMP,
+        notified_day = excluded.notified_day,
+        last_promo_price = excluded.last_promo_price
+'''
+
+_SQL_CLEAR_PRODUCT_NOTIFICATION = '''
+    DELETE FROM product_notifications
+    WHERE product_id = ?
+'''
+
+def _utc_timestamp() -> str:
+    """Current UTC time in the same format as CURRENT_TIMESTAMP"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+def _price_history_params(product_id: int, rows: List[Variant], checked_at: str) -> List[tuple]:
+    """Build _SQL_SAVE_PRICE_AT parameter tuples for a batch of variants"""
+    return [
+        (
+            product_id,
+            v.l2_id,
+            v.size_code,
+            v.color_code,
+            v.store_id,
+            v.store_name,
+            v.base_price,
+            v.promo_price,
+            v.is_on_sale,
+            checked_at
+        )
+        for v in rows
+    ]
+
+def _local_days() -> Tuple[int, int]:
+    """Today's and yesterday's local day numbers (date.toordinal()), from a single clock read"""
+    today = datetime.now().date().toordinal()
+    return today, today - 1
+
+def _decide_notification(info: dict, current_promo_price: int, today: int, yesterday: int) -> Tuple[bool, str]:
+    """Notification rule (max 3 consecutive days, re-notify on price drop); returns (should_send, reason)"""
+    consecutive_days = info['consecutive_days']
+    last_promo_price = info['last_promo_price']
+    last_day = info['last_day']
+    
+    # If never notified, can send
+    if last_day is None:
+        return True, "first_notification"
+    
+    # If notified today already, don't send
+    if last_day == today:
+        return False, "already_notified_today"
+    
+    # Check if consecutive days (yesterday)
+    is_consecutive = last_day == yesterday
+    
+    # If not consecutive (gap day), reset counter
+    if not is_consecutive:
+        return True, "new_sale_after_gap"
+    
+    # If already 3 consecutive days with same price, don't send
+    if consecutive_days >= 3:
+        if last_promo_price == current_promo_price:
+            return False, "max_3_days_same_price"
+        # But if price dropped, reset and send
+        if current_promo_price < last_promo_price:
+            return True, "price_dropped_reset"
+        return False, "max_3_days_reached"
+    
+    # If price is same as last time, continue counting
+    if last_promo_price == current_promo_price:
+        return True, "same_price_continue"
+    
+    # If price dropped (lower), reset counter and send
+    if current_promo_price < last_promo_price:
+        return True, "price_dropped_reset"
+    
+    # If price increased, don't send
+    return False, "price_increased"
+
+class PooledConnection(sqlite3.Connection):
+    """SQLite connection whose close() hands it back to its pool instead of closing it"""
+    
+    def close(self):
+        pool = getattr(self, 'pool', None)
+        if pool is None:
+            return super().close()
+        
+        # Never hand out a connection with a half-finished transaction
+        if self.in_transaction:
+            self.rollback()
+        try:
+            pool.put_nowait(self)
+        except queue.Full:
+            self.pool = None
+            super().close()
 
 class Database:
-    def __init__(self, db_file: str):
+    def __init__(self, db_file: str, pool_size: int = 8):
         self.db_file = db_file
+        # One long-lived writer shared by all threads; SQLite allows a single writer anyway
+        self._writer = self._configure(sqlite3.connect(db_file, check_same_thread=False, cached_statements=256))
+        self._write_lock = threading.Lock()
+        # Idle read-only connections, reused across calls and threads (asyncio.to_thread workers)
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        # Counters for pool_stats(); approximate under concurrency, for debugging only
+        self._reads_reused = 0
+        self._reads_opened = 0
+        self._writes = 0
         self.init_database()
     
+    @staticmethod
+    def _configure(conn: sqlite3.Connection) -> sqlite3.Connection:
+        # Per-connection tuning: WAL makes NORMAL sync safe and avoids an fsync per commit
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA mmap_size=268435456')
+        conn.execute('PRAGMA cache_size=-64000')
+        return conn
+    
+    def _open_connection(self) -> PooledConnection:
+        uri = Path(self.db_file).resolve().as_uri() + '?mode=ro'
+        conn = sqlite3.connect(
+            uri, uri=True, factory=PooledConnection, check_same_thread=False, cached_statements=256
+        )
+        self._configure(conn)
+        conn.pool = self._pool
+        return conn
+    
     def get_connection(self):
-        return sqlite3.connect(self.db_file)
+        """Get a pooled read-only connection; close() returns it to the pool"""
+        try:
+            conn = self._pool.get_nowait()
+            self._reads_reused += 1
+            return conn
+        except queue.Empty:
+            # Pool exhausted (or first use): open another one rather than block
+            self._reads_opened += 1
+            return self._open_connection()
+    
+    @contextmanager
+    def _write_connection(self):
+        """Hold the shared writer connection; anything left uncommitted is rolled back"""
+        with self._write_lock:
+            self._writes += 1
+            try:
+                yield self._writer
+            finally:
+                if self._writer.in_transaction:
+                    self._writer.rollback()
+    
+    def pool_stats(self) -> Dict:
+        """Connection pool counters for debugging"""
+        return {
+            'pool_size': self._pool.maxsize,
+            'idle_readers': self._pool.qsize(),
+            'reads_reused': self._reads_reused,
+            'reads_opened': self._reads_opened,
+            'writes': self._writes,
+            'writer_busy': self._write_lock.locked(),
+        }
     
     def init_database(self):
         """Initialize database tables"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Products table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS products (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                product_url TEXT NOT NULL,
-                product_id TEXT,
-                product_name TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(user_id, product_url)
-            )
-        ''')
-        
-        # Price history table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS price_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                product_id INTEGER,
-                l2_id TEXT,
-                size_code TEXT,
-                color_code TEXT,
-                store_id TEXT,
-                store_name TEXT,
-                base_price INTEGER,
-                promo_price INTEGER,
-                is_on_sale BOOLEAN,
-                checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (product_id) REFERENCES products (id)
-            )
-        ''')
-        
-        # Notifications sent table (to avoid duplicate notifications)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS notifications_sent (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                product_id INTEGER,
-                l2_id TEXT,
-                size_code TEXT,
-                notified_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (product_id) REFERENCES products (id),
-                UNIQUE(product_id, l2_id, size_code)
-            )
-        ''')
-        
-        # Product notifications table (one notification per product per day, max 3 days)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS product_notifications (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                product_id INTEGER UNIQUE,
-                notified_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_promo_price INTEGER,
-                consecutive_days INTEGER DEFAULT 1,
-                FOREIGN KEY (product_id) REFERENCES products (id)
-            )
-        ''')
-        
-        # User stores table (stores that user wants to monitor)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_stores (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                store_id TEXT NOT NULL,
-                store_name TEXT,
-                added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(user_id, store_id)
-            )
-        ''')
-        
-        # Migrate existing table if columns don't exist
-        try:
-            cursor.execute('SELECT consecutive_days FROM product_notifications LIMIT 1')
-        except sqlite3.OperationalError:
-            # Column doesn't exist, add it
-            try:
-                cursor.execute('ALTER TABLE product_notifications ADD COLUMN last_promo_price INTEGER')
-            except sqlite3.OperationalError:
-                pass  # Column might already exist
+        with self._write_connection() as conn:
+            cursor = conn.cursor()
+            
+            # WAL journal mode is persistent in the database file, so set it once here
+            cursor.execute('PRAGMA journal_mode=WAL')
             
+            # Schema already up to date: skip the CREATE/ALTER probing below
+            cursor.execute('PRAGMA user_version')
+            version = cursor.fetchone()[0]
+            if version >= SCHEMA_VERSION:
+                return
+            
+            # Products table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS products (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    product_url TEXT NOT NULL,
+                    product_id TEXT,
+                    product_name TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    check_count INTEGER DEFAULT 0,
+                    last_on_sale INTEGER DEFAULT 0,
+                    prev_on_sale INTEGER DEFAULT 0,
+                    last_checked_at TIMESTAMP,
+                    UNIQUE(user_id, product_url)
+                )
+            ''')
+            
+            # Price history table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS price_history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    product_id INTEGER,
+                    l2_id TEXT,
+                    size_code TEXT,
+                    color_code TEXT,
+                    store_id TEXT,
+                    store_name TEXT,
+                    base_price INTEGER,
+                    promo_price INTEGER,
+                    is_on_sale BOOLEAN,
+                    checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (product_id) REFERENCES products (id)
+                )
+            ''')
+            
+            # Notifications sent table (to avoid duplicate notifications)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS notifications_sent (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    product_id INTEGER,
+                    l2_id TEXT,
+                    size_code TEXT,
+                    notified_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (product_id) REFERENCES products (id),
+                    UNIQUE(product_id, l2_id, size_code)
+                )
+            ''')
+            
+            # Product notifications table (one notification per product per day, max 3 days)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS product_notifications (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    product_id INTEGER UNIQUE,
+                    notified_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    last_promo_price INTEGER,
+                    consecutive_days INTEGER DEFAULT 1,
+                    notified_day INTEGER,
+                    FOREIGN KEY (product_id) REFERENCES products (id)
+                )
+            ''')
+            
+            # User stores table (stores that user wants to monitor)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS user_stores (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    store_id TEXT NOT NULL,
+                    store_name TEXT,
+                    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE(user_id, store_id)
+                )
+            ''')
+            
+            # Index for date-range deletes on notification history
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_product_notifications_notified_at
+                ON product_notifications (notified_at)
+            ''')
+            
+            # Index for latest-price lookups per variant (get_last_price)
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_ph_prod_l2_size
+                ON price_history (product_id, l2_id, size_code, checked_at DESC)
+            ''')
+            
+            # Index for per-product check times (was_product_on_sale, get_product_check_state)
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_ph_product_time
+                ON price_history (product_id, checked_at DESC)
+            ''')
+            
+            # Startup flags table (one startup broadcast per UTC day)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS startup_flags (
+                    date TEXT PRIMARY KEY
+                )
+            ''')
+            
+            # Migrate existing table if columns don't exist
             try:
-                cursor.execute('ALTER TABLE product_notifications ADD COLUMN consecutive_days INTEGER DEFAULT 1')
+                cursor.execute('SELECT consecutive_days FROM product_notifications LIMIT 1')
             except sqlite3.OperationalError:
-                pass  # Column might already exist
-        
-        conn.commit()
-        conn.close()
+                # Column doesn't exist, add it
+                try:
+                    cursor.execute('ALTER TABLE product_notifications ADD COLUMN last_promo_price INTEGER')
+                except sqlite3.OperationalError:
+                    pass  # Column might already exist
+                
+                try:
+                    cursor.execute('ALTER TABLE product_notifications ADD COLUMN consecutive_days INTEGER DEFAULT 1')
+                except sqlite3.OperationalError:
+                    pass  # Column might already exist
+            
+            # v2: local calendar day of the last notification as an integer (date.toordinal())
+            if version < 2:
+                try:
+                    cursor.execute('ALTER TABLE product_notifications ADD COLUMN notified_day INTEGER')
+                except sqlite3.OperationalError:
+                    pass  # Column already created above (new database)
+                # julianday('0001-01-01') is 1721425.5 and its ordinal is 1
+                cursor.execute('''
+                    UPDATE product_notifications
+                    SET notified_day = CAST(julianday(DATE(notified_at, 'localtime')) - 1721424.5 AS INTEGER)
+                    WHERE notified_day IS NULL
+                ''')
+            
+            # v4: per-product check summary, since price_history only keeps changed rows
+            if version < 4:
+                for column in (
+                    'check_count INTEGER DEFAULT 0',
+                    'last_on_sale INTEGER DEFAULT 0',
+                    'prev_on_sale INTEGER DEFAULT 0',
+                    'last_checked_at TIMESTAMP'
+                ):
+                    try:
+                        cursor.execute(f'ALTER TABLE products ADD COLUMN {column}')
+                    except sqlite3.OperationalError:
+                        pass  # Column already created above (new database)
+                # Seed from the last two checks already in the history
+                cursor.execute('''
+                    WITH checks AS (
+                        SELECT product_id, checked_at, MAX(is_on_sale) AS on_sale,
+                            ROW_NUMBER() OVER (PARTITION BY product_id ORDER BY checked_at DESC) AS rk
+                        FROM price_history
+                        GROUP BY product_id, checked_at
+                    )
+                    UPDATE products SET
+                        check_count = (SELECT COUNT(*) FROM checks WHERE product_id = products.id AND rk <= 2),
+                        last_on_sale = COALESCE((SELECT on_sale FROM checks WHERE product_id = products.id AND rk = 1), 0),
+                        prev_on_sale = COALESCE((SELECT on_sale FROM checks WHERE product_id = products.id AND rk = 2), 0),
+                        last_checked_at = (SELECT checked_at FROM checks WHERE product_id = products.id AND rk = 1)
+                ''')
+            
+            cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            conn.commit()
     
     def add_product(self, user_id: int, product_url: str, product_id: str = None, product_name: str = None) -> int:
         """Add a product to monitor"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
-            # Check if product already exists for this user
-            cursor.execute('''
-                SELECT id FROM products WHERE user_id = ? AND product_url = ?
-            ''', (user_id, product_url))
-            existing = cursor.fetchone()
-            
-            if existing:
-                # Product already exists, return existing ID
-                return existing[0]
+        with self._write_connection() as conn:
+            cursor = conn.cursor()
             
-            # Insert new product
-            cursor.execute('''
-                INSERT INTO products (user_id, product_url, product_id, product_name)
-                VALUES (?, ?, ?, ?)
-            ''', (user_id, product_url, product_id, product_name))
-            conn.commit()
-            product_db_id = cursor.lastrowid
-            return product_db_id
-        except Exception as e:
-            print(f"Error adding product: {e}")
-            return None
-        finally:
-            conn.close()
+            try:
+                # Check if product already exists for this user
+                cursor.execute('''
+                    SELECT id FROM products WHERE user_id = ? AND product_url = ?
+                ''', (user_id, product_url))
+                existing = cursor.fetchone()
+                
+                if existing:
+                    # Product already exists, return existing ID
+                    return existing[0]
+                
+                # Insert new product
+                cursor.execute('''
+                    INSERT INTO products (user_id, product_url, product_id, product_name)
+                    VALUES (?, ?, ?, ?)
+                ''', (user_id, product_url, product_id, product_name))
+                conn.commit()
+                product_db_id = cursor.lastrowid
+                return product_db_id
+            except Exception as e:
+                print(f"Error adding product: {e}")
+                return None
     
     def get_user_products(self, user_id: int) -> List[Dict]:
         """Get all products monitored by a user"""
         conn = self.get_connection()
         cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
         
         cursor.execute('''
             SELECT id, product_url, product_id, product_name, created_at
@@ -143,15 +506,7 @@ class Database:
             WHERE user_id = ?
         ''', (user_id,))
         
-        products = []
-        for row in cursor.fetchall():
-            products.append({
-                'id': row[0],
-                'product_url': row[1],
-                'product_id': row[2],
-                'product_name': row[3],
-                'created_at': row[4]
-            })
+        products = [dict(row) for row in cursor.fetchall()]
         
         conn.close()
         return products
@@ -160,61 +515,110 @@ class Database:
         """Get all products being monitored"""
         conn = self.get_connection()
         cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
         
         cursor.execute('''
             SELECT id, user_id, product_url, product_id, product_name
             FROM products
         ''')
         
-        products = []
-        for row in cursor.fetchall():
-            products.append({
-                'id': row[0],
-                'user_id': row[1],
-                'product_url': row[2],
-                'product_id': row[3],
-                'product_name': row[4]
-            })
+        products = [dict(row) for row in cursor.fetchall()]
         
         conn.close()
         return products
     
-    def save_price_history(self, product_id: int, price_data: Dict):
-        """Save price history for a product"""
+    def get_product_by_id(self, product_db_id: int) -> Optional[Dict]:
+        """Get a single monitored product by its database ID"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
+        
+        cursor.execute(_SQL_PRODUCT_BY_ID, (product_db_id,))
+        
+        row = cursor.fetchone()
+        conn.close()
+        
+        return dict(row) if row else None
+    
+    def iter_products_grouped_by_user(self) -> Iterator[Tuple[int, List[Dict]]]:
+        """Yield (user_id, products) for every user that monitors at least one product"""
         conn = self.get_connection()
         cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
         
         cursor.execute('''
-            INSERT INTO price_history 
-            (product_id, l2_id, size_code, color_code, store_id, store_name, base_price, promo_price, is_on_sale)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            product_id,
-            price_data.get('l2_id'),
-            price_data.get('size_code'),
-            price_data.get('color_code'),
-            price_data.get('store_id'),
-            price_data.get('store_name'),
-            price_data.get('base_price'),
-            price_data.get('promo_price'),
-            price_data.get('is_on_sale', False)
-        ))
-        
-        conn.commit()
+            SELECT id, user_id, product_url, product_id, product_name
+            FROM products
+            ORDER BY user_id, id
+        ''')
+        rows = cursor.fetchall()
         conn.close()
+        
+        for user_id, user_rows in groupby(rows, key=lambda row: row['user_id']):
+            yield user_id, [dict(row) for row in user_rows]
+    
+    def save_price_history(self, product_id: int, price_data: Dict):
+        """Save price history for a product"""
+        with self._write_connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(_SQL_SAVE_PRICE, (
+                product_id,
+                price_data.get('l2_id'),
+                price_data.get('size_code'),
+                price_data.get('color_code'),
+                price_data.get('store_id'),
+                price_data.get('store_name'),
+                price_data.get('base_price'),
+                price_data.get('promo_price'),
+                price_data.get('is_on_sale', False)
+            ))
+            
+            conn.commit()
+    
+    def record_product_check(self, product_id: int, rows: List[Variant]) -> int:
+        """
+        Record one check of a product: store only variants whose price or sale state changed
+        since their last stored row, and update the product's check summary.
+        Returns the number of history rows written.
+        """
+        checked_at = _utc_timestamp()
+        on_sale = any(row.is_on_sale for row in rows)
+        
+        with self._write_connection() as conn:
+            with conn:
+                latest = {
+                    (l2_id, store_id): (base_price, promo_price, bool(is_on_sale))
+                    for l2_id, store_id, base_price, promo_price, is_on_sale
+                    in conn.execute(_SQL_LATEST_VARIANT_PRICES, (product_id,))
+                }
+                changed = [
+                    row for row in rows
+                    if latest.get((row.l2_id, row.store_id)) != (
+                        row.base_price, row.promo_price, bool(row.is_on_sale)
+                    )
+                ]
+                conn.executemany(_SQL_SAVE_PRICE_AT, _price_history_params(product_id, changed, checked_at))
+                conn.execute(_SQL_RECORD_PRODUCT_CHECK, (on_sale, checked_at, product_id))
+        
+        return len(changed)
+    
+    def cleanup_old_price_history(self, days: int = 30) -> int:
+        """Delete price history older than the given number of days"""
+        with self._write_connection() as conn:
+            with conn:
+                cursor = conn.execute('''
+                    DELETE FROM price_history
+                    WHERE checked_at < DATETIME('now', ?)
+                ''', (f'-{int(days)} day',))
+            return cursor.rowcount
     
     def get_last_price(self, product_id: int, l2_id: str, size_code: str) -> Optional[Dict]:
         """Get the last known price for a product variant"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT base_price, promo_price, is_on_sale, checked_at
-            FROM price_history
-            WHERE product_id = ? AND l2_id = ? AND size_code = ?
-            ORDER BY checked_at DESC
-            LIMIT 1
-        ''', (product_id, l2_id, size_code))
+        cursor.execute(_SQL_LAST_PRICE, (product_id, l2_id, size_code))
         
         row = cursor.fetchone()
         conn.close()
@@ -233,101 +637,92 @@ class Database:
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT COUNT(*) FROM notifications_sent
-            WHERE product_id = ? AND l2_id = ? AND size_code = ?
-        ''', (product_id, l2_id, size_code))
+        cursor.execute(_SQL_HAS_NOTIFICATION, (product_id, l2_id, size_code))
         
-        count = cursor.fetchone()[0]
+        exists = cursor.fetchone()[0]
         conn.close()
-        return count > 0
+        return bool(exists)
     
     def mark_notification_sent(self, product_id: int, l2_id: str, size_code: str):
         """Mark that notification has been sent"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Use INSERT OR REPLACE to avoid duplicates
-        cursor.execute('''
-            INSERT OR REPLACE INTO notifications_sent (product_id, l2_id, size_code)
-            VALUES (?, ?, ?)
-        ''', (product_id, l2_id, size_code))
-        
-        conn.commit()
-        conn.close()
+        with self._write_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Use INSERT OR REPLACE to avoid duplicates
+            cursor.execute(_SQL_MARK_NOTIFICATION, (product_id, l2_id, size_code))
+            
+            conn.commit()
     
     def clear_notification_flag(self, product_id: int, l2_id: str, size_code: str):
         """Clear notification flag when sale ends (allows re-notification if sale comes back)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            DELETE FROM notifications_sent
-            WHERE product_id = ? AND l2_id = ? AND size_code = ?
-        ''', (product_id, l2_id, size_code))
-        
-        conn.commit()
-        conn.close()
+        with self._write_connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(_SQL_CLEAR_NOTIFICATION, (product_id, l2_id, size_code))
+            
+            conn.commit()
     
     def has_price_history(self, product_id: int) -> bool:
         """Check if product has any price history"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT COUNT(*) FROM price_history
-            WHERE product_id = ?
-        ''', (product_id,))
+        cursor.execute(_SQL_HAS_PRICE_HISTORY, (product_id,))
         
-        count = cursor.fetchone()[0]
+        exists = cursor.fetchone()[0]
         conn.close()
-        return count > 0
+        return bool(exists)
     
     def was_product_on_sale(self, product_id: int) -> bool:
         """Check if product was on sale in the previous check (before current check)"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        # Get distinct check times, ordered by most recent
-        cursor.execute('''
-            SELECT DISTINCT checked_at FROM price_history
-            WHERE product_id = ?
-            ORDER BY checked_at DESC
-            LIMIT 2
-        ''', (product_id,))
+        # Summary is updated by record_product_check (absent/0 before the second check)
+        cursor.execute(_SQL_WAS_ON_SALE, (product_id,))
         
-        times = cursor.fetchall()
+        row = cursor.fetchone()
+        conn.close()
         
-        if len(times) < 2:
-            # Only one check or no checks - this is the first check, so wasn't on sale before
-            return False
+        return bool(row and row[0])
+    
+    def get_product_check_state(self, product_id: int) -> Dict:
+        """Get has_history, was_on_sale and notification info for a product in one query"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
         
-        # Get the previous check time (second most recent)
-        previous_check_time = times[1][0]
+        cursor.execute(_SQL_PRODUCT_CHECK_STATE, (product_id,))
         
-        # Check if any variant was on sale in the previous check
-        cursor.execute('''
-            SELECT COUNT(*) FROM price_history
-            WHERE product_id = ? 
-            AND checked_at = ?
-            AND is_on_sale = 1
-        ''', (product_id, previous_check_time))
-        
-        count = cursor.fetchone()[0]
+        row = cursor.fetchone() or (0, 0, None, None, None)
+        n_checks, prev_on_sale, consecutive_days, last_promo_price, last_day = row
         conn.close()
         
-        return count > 0
+        if last_day is None:
+            notification_info = {
+                'consecutive_days': 0,
+                'last_promo_price': None,
+                'last_day': None
+            }
+        else:
+            notification_info = {
+                'consecutive_days': consecutive_days or 1,
+                'last_promo_price': last_promo_price,
+                'last_day': last_day
+            }
+        
+        return {
+            'has_history': n_checks > 0,
+            # Same rule as was_product_on_sale(): needs a previous check to compare against
+            'was_on_sale': n_checks >= 2 and bool(prev_on_sale),
+            'notification_info': notification_info
+        }
     
     def get_product_notification_info(self, product_id: int) -> dict:
-        """Get notification info for product: consecutive_days, last_promo_price, last_notified_date"""
+        """Get notification info for product: consecutive_days, last_promo_price, last_day (date ordinal)"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT consecutive_days, last_promo_price, DATE(notified_at) as last_date
-            FROM product_notifications
-            WHERE product_id = ?
-        ''', (product_id,))
+        cursor.execute(_SQL_NOTIFICATION_INFO, (product_id,))
         
         row = cursor.fetchone()
         conn.close()
@@ -336,199 +731,176 @@ class Database:
             return {
                 'consecutive_days': row[0] or 1,
                 'last_promo_price': row[1],
-                'last_date': row[2]
+                'last_day': row[2]
             }
         return {
             'consecutive_days': 0,
             'last_promo_price': None,
-            'last_date': None
+            'last_day': None
         }
     
-    def should_send_notification(self, product_id: int, current_promo_price: int):
+    def should_send_notification(self, product_id: int, current_promo_price: int, info: dict = None):
         """
         Check if should send notification based on:
         - Max 3 consecutive days
         - Price must be lower than last notified price (or first time)
+        Pass info (from get_product_check_state) to skip re-reading it.
         Returns: (should_send, reason)
         """
-        info = self.get_product_notification_info(product_id)
-        consecutive_days = info['consecutive_days']
-        last_promo_price = info['last_promo_price']
-        last_date = info['last_date']
-        
-        from datetime import datetime
-        today = datetime.now().date().isoformat()
-        
-        # If never notified, can send
-        if last_date is None:
-            return True, "first_notification"
-        
-        # If notified today already, don't send
-        if last_date == today:
-            return False, "already_notified_today"
-        
-        # Check if consecutive days (yesterday)
-        from datetime import datetime, timedelta
-        yesterday = (datetime.now() - timedelta(days=1)).date().isoformat()
-        is_consecutive = last_date == yesterday
-        
-        # If not consecutive (gap day), reset counter
-        if not is_consecutive:
-            return True, "new_sale_after_gap"
-        
-        # If already 3 consecutive days with same price, don't send
-        if consecutive_days >= 3:
-            if last_promo_price == current_promo_price:
-                return False, "max_3_days_same_price"
-            # But if price dropped, reset and send
-            if current_promo_price < last_promo_price:
-                return True, "price_dropped_reset"
-            return False, "max_3_days_reached"
-        
-        # If price is same as last time, continue counting
-        if last_promo_price == current_promo_price:
-            return True, "same_price_continue"
+        if info is None:
+            info = self.get_product_notification_info(product_id)
+        today, yesterday = _local_days()
+        return _decide_notification(info, current_promo_price, today, yesterday)
+    
+    def reserve_notification(self, product_id: int, promo_price: int) -> Tuple[bool, str, Optional[tuple]]:
+        """
+        Decide whether to notify and, if so, record the notification in the same transaction.
+        Returns: (should_send, reason, previous_row); pass previous_row to release_notification()
+        if the message could not be delivered.
+        """
+        today, yesterday = _local_days()
         
-        # If price dropped (lower), reset counter and send
-        if current_promo_price < last_promo_price:
-            return True, "price_dropped_reset"
+        with self._write_connection() as conn:
+            # IMMEDIATE takes the write lock up front, so the read and the upsert see the same row
+            conn.execute('BEGIN IMMEDIATE')
+            previous_row = conn.execute(_SQL_NOTIFICATION_ROW, (product_id,)).fetchone()
+            
+            if previous_row is None:
+                info = {'consecutive_days': 0, 'last_promo_price': None, 'last_day': None}
+            else:
+                _, last_promo_price, consecutive_days, last_day = previous_row
+                info = {
+                    'consecutive_days': consecutive_days or 1,
+                    'last_promo_price': last_promo_price,
+                    'last_day': last_day
+                }
+            
+            should_send, reason = _decide_notification(info, promo_price, today, yesterday)
+            if should_send:
+                conn.execute(_SQL_UPSERT_PRODUCT_NOTIFICATION, {
+                    'product_id': product_id,
+                    'promo_price': promo_price,
+                    'today': today,
+                    'yesterday': yesterday
+                })
+            conn.commit()
         
-        # If price increased, don't send
-        return False, "price_increased"
+        return should_send, reason, previous_row
+    
+    def release_notification(self, product_id: int, previous_row: Optional[tuple]):
+        """Undo reserve_notification() after a failed send (restores the previous row)"""
+        with self._write_connection() as conn:
+            if previous_row is None:
+                conn.execute(_SQL_CLEAR_PRODUCT_NOTIFICATION, (product_id,))
+            else:
+                conn.execute(_SQL_RESTORE_PRODUCT_NOTIFICATION, (product_id, *previous_row))
+            conn.commit()
     
     def mark_product_notification_sent(self, product_id: int, promo_price: int):
         """Mark that notification has been sent for this product today with price"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Get current info
-        info = self.get_product_notification_info(product_id)
-        consecutive_days = info['consecutive_days']
-        last_date = info['last_date']
-        last_promo_price = info['last_promo_price']
-        
-        from datetime import datetime, timedelta
-        today = datetime.now().date().isoformat()
-        yesterday = (datetime.now() - timedelta(days=1)).date().isoformat()
-        
-        # Calculate new consecutive days
-        if last_date is None:
-            # First notification
-            new_consecutive_days = 1
-        elif last_date == yesterday:
-            # Consecutive day
-            if last_promo_price == promo_price:
-                # Same price, continue counting
-                new_consecutive_days = consecutive_days + 1
-            else:
-                # Different price, reset counter
-                new_consecutive_days = 1
-        else:
-            # Gap day, reset counter
-            new_consecutive_days = 1
+        today, yesterday = _local_days()
         
-        # Update or insert with current timestamp, price, and consecutive days
-        cursor.execute('''
-            INSERT OR REPLACE INTO product_notifications 
-            (product_id, notified_at, last_promo_price, consecutive_days)
-            VALUES (?, CURRENT_TIMESTAMP, ?, ?)
-        ''', (product_id, promo_price, new_consecutive_days))
-        
-        conn.commit()
-        conn.close()
+        with self._write_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Update or insert with current timestamp, price, and consecutive days
+            cursor.execute(_SQL_UPSERT_PRODUCT_NOTIFICATION, {
+                'product_id': product_id,
+                'promo_price': promo_price,
+                'today': today,
+                'yesterday': yesterday
+            })
+            
+            conn.commit()
     
     def clear_product_notification_flag(self, product_id: int):
         """Clear notification flag when sale ends (allows re-notification if sale comes back)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            DELETE FROM product_notifications
-            WHERE product_id = ?
-        ''', (product_id,))
-        
-        conn.commit()
-        conn.close()
+        with self._write_connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(_SQL_CLEAR_PRODUCT_NOTIFICATION, (product_id,))
+            
+            conn.commit()
     
     def cleanup_old_notifications(self):
         """Clean up notifications older than 1 day (optional maintenance)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Delete notifications older than 1 day
-        cursor.execute('''
-            DELETE FROM product_notifications
-            WHERE DATE(notified_at) < DATE('now', '-1 day')
-        ''')
-        
-        conn.commit()
-        conn.close()
+        with self._write_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Delete notifications older than 1 day
+            cursor.execute('''
+                DELETE FROM product_notifications
+                WHERE DATE(notified_at) < DATE('now', '-1 day')
+            ''')
+            
+            conn.commit()
     
     def reset_today_notifications(self):
         """Reset all notifications for today (allow re-notification today)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Delete notifications sent today
-        cursor.execute('''
-            DELETE FROM product_notifications
-            WHERE DATE(notified_at) = DATE('now')
-        ''')
-        
-        deleted = cursor.rowcount
-        conn.commit()
-        conn.close()
-        return deleted
+        with self._write_connection() as conn:
+            # Single range delete in one explicit transaction (uses notified_at index)
+            with conn:
+                cursor = conn.execute('''
+                    DELETE FROM product_notifications
+                    WHERE notified_at >= DATE('now')
+                    AND notified_at < DATE('now', '+1 day')
+                ''')
+            return cursor.rowcount
     
     def reset_all_notifications(self):
         """Reset all notifications (clear all notification history)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('DELETE FROM product_notifications')
-        
-        deleted = cursor.rowcount
-        conn.commit()
-        conn.close()
-        return deleted
+        with self._write_connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('DELETE FROM product_notifications')
+            
+            deleted = cursor.rowcount
+            conn.commit()
+            return deleted
+    
+    def update_product_id(self, product_db_id: int, product_id: str):
+        """Store the Uniqlo product ID resolved from a product's URL"""
+        with self._write_connection() as conn:
+            with conn:
+                conn.execute('''
+                    UPDATE products SET product_id = ? WHERE id = ?
+                ''', (product_id, product_db_id))
     
     def delete_product(self, user_id: int, product_id: int) -> bool:
         """Delete a product from monitoring"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            DELETE FROM products WHERE id = ? AND user_id = ?
-        ''', (product_id, user_id))
-        
-        deleted = cursor.rowcount > 0
-        conn.commit()
-        conn.close()
-        return deleted
+        with self._write_connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                DELETE FROM products WHERE id = ? AND user_id = ?
+            ''', (product_id, user_id))
+            
+            deleted = cursor.rowcount > 0
+            conn.commit()
+            return deleted
     
     # User stores management
     def add_user_store(self, user_id: int, store_id: str, store_name: str = None) -> bool:
         """Add a store to user's monitoring list"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute('''
-                INSERT OR IGNORE INTO user_stores (user_id, store_id, store_name)
-                VALUES (?, ?, ?)
-            ''', (user_id, store_id, store_name))
-            conn.commit()
-            return cursor.rowcount > 0
-        except Exception as e:
-            print(f"Error adding user store: {e}")
-            return False
-        finally:
-            conn.close()
+        with self._write_connection() as conn:
+            cursor = conn.cursor()
+            
+            try:
+                cursor.execute('''
+                    INSERT OR IGNORE INTO user_stores (user_id, store_id, store_name)
+                    VALUES (?, ?, ?)
+                ''', (user_id, store_id, store_name))
+                conn.commit()
+                return cursor.rowcount > 0
+            except Exception as e:
+                print(f"Error adding user store: {e}")
+                return False
     
     def get_user_stores(self, user_id: int) -> List[Dict]:
         """Get all stores monitored by a user"""
         conn = self.get_connection()
         cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
         
         cursor.execute('''
             SELECT store_id, store_name, added_at
@@ -537,33 +909,67 @@ class Database:
             ORDER BY added_at DESC
         ''', (user_id,))
         
-        stores = []
-        for row in cursor.fetchall():
-            stores.append({
-                'store_id': row[0],
-                'store_name': row[1],
-                'added_at': row[2]
-            })
+        stores = [dict(row) for row in cursor.fetchall()]
         
         conn.close()
         return stores
     
     def delete_user_store(self, user_id: int, store_id: str) -> bool:
         """Remove a store from user's monitoring list"""
+        with self._write_connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                DELETE FROM user_stores WHERE user_id = ? AND store_id = ?
+            ''', (user_id, store_id))
+            
+            deleted = cursor.rowcount > 0
+            conn.commit()
+            return deleted
+    
+    def get_all_user_store_ids(self, user_id: int) -> List[str]:
+        """Get list of store IDs for a user"""
+        stores = self.get_user_stores(user_id)
+        return [store['store_id'] for store in stores]
+    
+    def get_store_ids_by_user(self) -> Dict[int, List[str]]:
+        """Get every user's store IDs in one query, as {user_id: [store_id, ...]} (newest first)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT user_id, store_id
+            FROM user_stores
+            ORDER BY user_id, added_at DESC
+        ''')
+        rows = cursor.fetchall()
+        conn.close()
+        
+        return {
+            user_id: [store_id for _, store_id in user_rows]
+            for user_id, user_rows in groupby(rows, key=lambda row: row[0])
+        }
+    
+    def has_sent_startup_today(self) -> bool:
+        """Check if the startup broadcast already ran today (UTC)"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
         cursor.execute('''
-            DELETE FROM user_stores WHERE user_id = ? AND store_id = ?
-        ''', (user_id, store_id))
+            SELECT 1 FROM startup_flags WHERE date = DATE('now')
+        ''')
         
-        deleted = cursor.rowcount > 0
-        conn.commit()
+        row = cursor.fetchone()
         conn.close()
-        return deleted
+        return row is not None
     
-    def get_all_user_store_ids(self, user_id: int) -> List[str]:
-        """Get list of store IDs for a user"""
-        stores = self.get_user_stores(user_id)
-        return [store['store_id'] for store in stores]
-
+    def mark_startup_sent_today(self):
+        """Record that the startup broadcast ran today (UTC)"""
+        with self._write_connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                INSERT OR IGNORE INTO startup_flags (date) VALUES (DATE('now'))
+            ''')
+            
+            conn.commit()
@@ -0,0 +1,19 @@
+from dataclasses import dataclass
+
+
+@dataclass(slots=True)
+class Variant:
+    """One in-stock product variant (color/size) at one store, as parsed from the Uniqlo API"""
+    l2_id: str
+    size_code: str
+    size_name: str
+    color_code: str
+    base_price: int
+    promo_price: int
+    is_on_sale: bool
+    store_name: str
+    stock_status: str
+    stock_quantity: int
+    store_id: str = None
+    # is_on_sale and actually discounted (base_price > promo_price); set by the parser
+    on_sale_effective: bool = False
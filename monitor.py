@@ -1,25 +1,189 @@
 import asyncio
+import functools
+import logging
+import re
+from collections import defaultdict
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict, List, Optional, Set
 from telegram import Bot
 from telegram.constants import ParseMode
 
 from database import Database
-from uniqlo_api import UniqloAPI
-from config import CHECK_INTERVAL_MINUTES, STORE_IDS
+from uniqlo_api import UniqloAPI, parse_size
+from models import Variant
+from ratelimit import AdaptiveRateLimiter
+from cache import TTLCache
+from config import (
+    CHECK_INTERVAL_MINUTES, STORE_IDS, MAX_CONCURRENT_CHECKS, UNIQLO_API_RATE_PER_SECOND,
+    PRICE_HISTORY_RETENTION_DAYS, MAX_CONCURRENT_STORE_FETCHES
+)
+
+logger = logging.getLogger(__name__)
+
+# Display order for standard letter sizes (keys are upper-case)
+_SIZE_ORDER = {
+    'FREE SIZE': -1, 'XXS': 0, 'XS': 1, 'S': 2, 'M': 3,
+    'L': 4, 'XL': 5, 'XXL': 6, 'XXXL': 7, '4XL': 8, '5XL': 9
+}
+
+_DIGITS_RE = re.compile(r'(\d+)')
+
+_COMMA_TO_DOT = str.maketrans(',', '.')
+
+# Header of the sale notification; filled once per message with str.format
+_SALE_HEADER_TPL = (
+    "🎉 **PRODUK SEDANG SALE!**\n\n"
+    "📦 **{product_name}**\n\n"
+    "💰 **Harga Normal:** {base_price}\n"
+    "🔥 **Harga Sale:** {promo_price}\n"
+    "💸 **Diskon:** {discount} ({discount_percent}%)\n\n"
+)
+
+# Per-store lines shared by the sale and out-of-stock notifications
+_STORE_SALE_TPL = "\n• **{store_name}** ✅\n  📏 Size: {sizes}\n  💰 Harga: {price}\n"
+_STORE_NO_STOCK_TPL = "\n• **{store_name}** ❌\n  📏 Size: Tidak tersedia\n"
+
+@functools.lru_cache(maxsize=1024)
+def _format_price(price: int) -> str:
+    """Format a price as IDR with dot thousand separators, e.g. Rp 199.000"""
+    return f"Rp {price:,}".translate(_COMMA_TO_DOT)
+
+@functools.lru_cache(maxsize=1024)
+def _sort_size(size_str: str):
+    """Sort key for size names: letter sizes, then inch sizes, cm sizes, numeric codes, then the rest"""
+    size_upper = size_str.upper()
+    
+    # If it's a standard size, use the predefined order
+    order = _SIZE_ORDER.get(size_upper)
+    if order is not None:
+        return (0, order)
+    
+    # If it's an inch size (e.g., 27", 28", etc.)
+    if '"' in size_str or 'INCH' in size_upper:
+        match = _DIGITS_RE.search(size_str)
+        if match:
+            return (1, int(match.group(1)))
+    
+    # If it's a cm size (e.g., 100cm, 110cm, etc.)
+    if 'CM' in size_upper:
+        match = _DIGITS_RE.search(size_str)
+        if match:
+            return (2, int(match.group(1)))
+    
+    # If it's a pure number (e.g., 027, 028, etc.)
+    if size_str.isdigit():
+        return (3, int(size_str))
+    
+    # Default: alphabetical
+    return (99, size_str)
+
+@functools.lru_cache(maxsize=1024)
+def _join_sizes(sizes: frozenset) -> str:
+    """Sorted, comma-joined size list; stores often share the same set of sizes"""
+    return ", ".join(sorted(sizes, key=_sort_size))
 
 class ProductMonitor:
     def __init__(self, db: Database, api: UniqloAPI):
         self.db = db
         self.api = api
         self.monitoring = False
+        self._monitor_task = None
+        # Smoothed duration (seconds) of recent monitoring sweeps, None before the first one
+        self.sweep_duration_ewma = None
+        # Shared pacing for Uniqlo API calls made by concurrent checks; backs off on 429/5xx
+        self.api_limiter = AdaptiveRateLimiter(UNIQLO_API_RATE_PER_SECOND, 1)
+        self.api.on_response = self.api_limiter.record_response
+        # In-flight store lookups, so concurrent checks share one request per store
+        self._store_info_tasks = {}
+        # Well below CHECK_INTERVAL_MINUTES so every monitoring cycle sees fresh prices
+        self.product_info_cache = TTLCache(maxsize=2048, ttl=60)
+        # Caps in-flight per-store fetches across all concurrent checks
+        self.store_semaphore = asyncio.Semaphore(MAX_CONCURRENT_STORE_FETCHES)
+    
+    async def _api_call(self, func, *args):
+        """Run a blocking Uniqlo API call in a worker thread, within the API rate limit"""
+        async with self.api_limiter:
+            return await asyncio.to_thread(func, *args)
+    
+    async def _get_store_info(self, store_id: str):
+        """Get store info, cached (store details rarely change)"""
+        store_info = self.api.store_info_cache.get(store_id)
+        if store_info is not None:
+            return store_info
+        
+        # Cache miss: join an in-flight lookup for this store or start one
+        task = self._store_info_tasks.get(store_id)
+        if task is None:
+            task = asyncio.ensure_future(self._api_call(self.api.get_store_info, store_id))
+            self._store_info_tasks[store_id] = task
+            task.add_done_callback(lambda _: self._store_info_tasks.pop(store_id, None))
+        return await asyncio.shield(task)
     
-    async def check_product(self, product_db_id: int, user_id: int, bot: Bot = None):
-        """Check a single product for price changes across multiple stores"""
+    async def _get_store_names(self, store_ids: List[str]) -> Dict[str, str]:
+        """Look up display names for several stores concurrently"""
+        results = await asyncio.gather(
+            *[self._get_store_info(store_id) for store_id in store_ids],
+            return_exceptions=True
+        )
+        store_names = {}
+        for store_id, store_info in zip(store_ids, results):
+            if isinstance(store_info, Exception):
+                logger.error("Error getting store info for %s: %s", store_id, store_info)
+                store_info = None
+            if store_info and isinstance(store_info, dict):
+                store_names[store_id] = store_info.get('name', f'Store {store_id}')
+            else:
+                store_names[store_id] = f'Store {store_id}'
+        return store_names
+    
+    async def _get_product_info(self, product_id: str, store_id: str):
+        """Get product data for a store, cached briefly to collapse repeat fetches within a check"""
+        key = (product_id, store_id)
+        product_data = self.product_info_cache.get(key)
+        if product_data is None:
+            product_data = await self._api_call(self.api.get_product_info, product_id, store_id)
+            if product_data:
+                self.product_info_cache.set(key, product_data)
+        return product_data
+    
+    async def _process_store(self, product_id: str, store_id: str) -> List[Variant]:
+        """Fetch and parse a product's variants for one store"""
+        async with self.store_semaphore:
+            # Get product data from API for this store
+            product_data = await self._get_product_info(product_id, store_id)
+            if not product_data or not isinstance(product_data, dict):
+                logger.debug("No product data for store %s", store_id)
+                return []
+            
+            # Get store info
+            store_info = await self._get_store_info(store_id)
+            if store_info and isinstance(store_info, dict):
+                store_name = store_info.get('name', f'Store {store_id}')
+            else:
+                store_name = f'Store {store_id}'
+        
+        # Parse product variants for this store
+        if not product_data.get('l2s') or not isinstance(product_data.get('l2s'), list):
+            logger.debug("No l2s data in product_data for store %s", store_id)
+            return []
+        
+        # Trust API response with storeId parameter - it filters by store stock
+        variants = self.api.parse_product_data(product_data, store_name, store_id)
+        
+        if not variants:
+            logger.debug("No variants found for store %s", store_id)
+            return []
+        
+        logger.debug("Found %d variants in store %s (%s)", len(variants), store_id, store_name)
+        return variants
+    
+    async def check_product(self, product_db_id: int, user_id: int, bot: Bot = None,
+                            product: Optional[Dict] = None, user_store_ids: Optional[List[str]] = None):
+        """Check a single product for price changes across multiple stores (pass product/user_store_ids to skip DB lookups)"""
         try:
             # Get product info from database
-            products = self.db.get_all_products()
-            product = next((p for p in products if p['id'] == product_db_id), None)
+            if product is None:
+                product = await asyncio.to_thread(self.db.get_product_by_id, product_db_id)
             
             if not product:
                 return
@@ -32,64 +196,32 @@ class ProductMonitor:
                 # Try to extract from URL
                 product_id = self.api.extract_product_id_from_url(product_url)
                 if not product_id:
-                    print(f"[ERROR] Cannot extract product ID from URL: {product_url}")
+                    logger.error("Cannot extract product ID from URL: %s", product_url)
                     return
+                # Save it so later checks skip the URL parsing
+                await asyncio.to_thread(self.db.update_product_id, product_db_id, product_id)
             
-            print(f"[DEBUG] Checking product: {product_name} (ID: {product_id})")
-            
-            # Collect all variants from all stores
-            all_variants = []
-            store_names = {}  # Map store_id to store_name
+            logger.debug("Checking product: %s (ID: %s)", product_name, product_id)
             
             # Get user's store list (if empty, use default from config)
-            user_store_ids = self.db.get_all_user_store_ids(user_id)
+            if user_store_ids is None:
+                user_store_ids = await asyncio.to_thread(self.db.get_all_user_store_ids, user_id)
             if not user_store_ids:
                 user_store_ids = STORE_IDS  # Fallback to default stores
             
-            print(f"[DEBUG] Checking product {product_db_id} across {len(user_store_ids)} stores")
+            logger.debug("Checking product %s across %d stores", product_db_id, len(user_store_ids))
             
-            # Loop through all stores
-            for store_id in user_store_ids:
-                try:
-                    # Get product data from API for this store
-                    product_data = self.api.get_product_info(product_id, store_id)
-                    if not product_data or not isinstance(product_data, dict):
-                        print(f"[DEBUG] No product data for store {store_id}")
-                        continue
-                    
-                    # Get store info
-                    store_info = self.api.get_store_info(store_id)
-                    if store_info and isinstance(store_info, dict):
-                        store_name = store_info.get('name', f'Store {store_id}')
-                    else:
-                        store_name = f'Store {store_id}'
-                    
-                    store_names[store_id] = store_name
-                    
-                    # Parse product variants for this store
-                    if not product_data.get('l2s') or not isinstance(product_data.get('l2s'), list):
-                        print(f"[DEBUG] No l2s data in product_data for store {store_id}")
-                        continue
-                    
-                    variants = self.api.parse_product_data(product_data, store_name)
-                    
-                    if not variants:
-                        print(f"[DEBUG] No variants found for store {store_id}")
-                        continue
-                    
-                    # Add store_id to each variant
-                    # Trust API response with storeId parameter - it filters by store stock
-                    for variant in variants:
-                        variant['store_id'] = store_id
-                    
-                    all_variants.extend(variants)
-                    print(f"[DEBUG] Found {len(variants)} variants in store {store_id} ({store_name})")
-                    
-                    # Small delay between API calls
-                    await asyncio.sleep(0.5)
-                except Exception as e:
-                    print(f"[ERROR] Error processing store {store_id}: {e}")
+            # Fetch all stores concurrently and collect their variants
+            results = await asyncio.gather(
+                *[self._process_store(product_id, store_id) for store_id in user_store_ids],
+                return_exceptions=True
+            )
+            all_variants = []
+            for store_id, result in zip(user_store_ids, results):
+                if isinstance(result, Exception):
+                    logger.error("Error processing store %s: %s", store_id, result)
                     continue
+                all_variants.extend(result)
             
             # Get all sizes and colors from product (regardless of stock)
             # Use first store's data to get all available sizes/colors
@@ -100,44 +232,14 @@ class ProductMonitor:
                 try:
                     # Get product data from first store to extract all sizes/colors
                     first_store_id = user_store_ids[0]
-                    product_data = self.api.get_product_info(product_id, first_store_id)
+                    product_data = await self._get_product_info(product_id, first_store_id)
                     if product_data and isinstance(product_data, dict):
                         l2s = product_data.get('l2s', [])
-                        # Size code mapping (same as parse_product_data)
-                        SIZE_CODE_MAP = {
-                            '00': 'FREE SIZE', '001': 'XXS', '002': 'XS', '003': 'S', '004': 'M', 
-                            '005': 'L', '006': 'XL', '007': 'XXL', '008': 'XXXL', '009': '4XL', '010': '5XL',
-                            '027': '27"', '028': '28"', '029': '29"', '030': '30"', '031': '31"', '032': '32"',
-                            '033': '33"', '034': '34"', '035': '35"', '036': '36"', '037': '37"', '038': '38"',
-                            '040': '40"', '042': '42"',
-                            '100': '100cm', '110': '110cm', '120': '120cm', '130': '130cm', 
-                            '140': '140cm', '150': '150cm', '160': '160cm',
-                        }
-                        
                         for l2 in l2s:
-                            size_obj = l2.get('size', {})
                             color_obj = l2.get('color', {})
                             
-                            # Get size code
-                            display_code = size_obj.get('displayCode', '')
-                            full_size_code = size_obj.get('sizeCode', '')
-                            
-                            # Extract numeric part if needed
-                            if full_size_code and not display_code:
-                                import re
-                                match = re.search(r'(\d{2,3})$', full_size_code)
-                                if match:
-                                    display_code = match.group(1)
-                            
-                            size_code = display_code or full_size_code
-                            
                             # Get size name using SIZE_CODE_MAP
-                            size_name = (
-                                size_obj.get('name') or 
-                                size_obj.get('displayName') or 
-                                size_obj.get('label') or
-                                SIZE_CODE_MAP.get(size_code, size_code)
-                            )
+                            _, size_name = parse_size(l2.get('size', {}))
                             if size_name:
                                 all_sizes.add(size_name)
                             
@@ -157,107 +259,87 @@ class ProductMonitor:
                             if color_name:
                                 all_colors.add(color_name)
                 except Exception as e:
-                    print(f"[ERROR] Error getting all sizes/colors: {e}")
+                    logger.error("Error getting all sizes/colors: %s", e)
             
             # If no variants in stock, send simple notification with all sizes/colors
             if not all_variants:
-                print(f"[DEBUG] No variants in stock for product {product_db_id}")
+                logger.debug("No variants in stock for product %s", product_db_id)
                 
                 # Send simple notification if bot is provided
                 if bot:
-                    print(f"[DEBUG] Sending product info notification for product {product_db_id}")
+                    logger.debug("Sending product info notification for product %s", product_db_id)
                     try:
                         sizes_str = ", ".join(sorted(all_sizes)) if all_sizes else "Tidak tersedia"
                         colors_str = ", ".join(sorted(all_colors)) if all_colors else ""
                         
-                        message = f"📦 **{product_name}**\n\n"
+                        parts = [f"📦 **{product_name}**\n\n"]
                         
                         if sizes_str or colors_str:
-                            message += f"🌐 **Tersedia di Offline dan Online Store:**\n"
+                            parts.append("🌐 **Tersedia di Offline dan Online Store:**\n")
                             if sizes_str:
-                                message += f"📏 **Size:** {sizes_str}\n"
+                                parts.append(f"📏 **Size:** {sizes_str}\n")
                             if colors_str:
-                                message += f"🎨 **Warna:** {colors_str}\n"
-                            message += "\n"
+                                parts.append(f"🎨 **Warna:** {colors_str}\n")
+                            parts.append("\n")
                         
                         # Add all monitored stores
-                        message += "🏪 **Toko:**\n"
+                        parts.append("🏪 **Toko:**\n")
+                        store_names = await self._get_store_names(user_store_ids)
                         for store_id in user_store_ids:
-                            try:
-                                store_info = self.api.get_store_info(store_id)
-                                if store_info and isinstance(store_info, dict):
-                                    store_name = store_info.get('name', f'Store {store_id}')
-                                else:
-                                    store_name = f'Store {store_id}'
-                            except Exception:
-                                store_name = f'Store {store_id}'
-                            
-                            message += f"\n• **{store_name}** ❌\n"
-                            message += f"  📏 Size: Tidak tersedia\n"
+                            parts.append(_STORE_NO_STOCK_TPL.format(store_name=store_names[store_id]))
                         
-                        message += "\n"
-                        message += (
-                            f"🔔 Bot akan terus memantau dan mengirim notifikasi saat:\n"
-                            f"   • Produk sedang sale\n\n"
+                        parts.append(
+                            "\n"
+                            "🔔 Bot akan terus memantau dan mengirim notifikasi saat:\n"
+                            "   • Produk sedang sale\n\n"
                             f"⏰ {datetime.now().strftime('%d/%m/%Y %H:%M')}"
                         )
                         
                         await bot.send_message(
                             chat_id=user_id,
-                            text=message,
+                            text="".join(parts),
                             parse_mode=ParseMode.MARKDOWN
                         )
-                        print(f"[DEBUG] Product info notification sent successfully")
+                        logger.debug("Product info notification sent successfully")
                     except Exception as e:
-                        print(f"[ERROR] Failed to send product info notification: {e}")
+                        logger.error("Failed to send product info notification: %s", e)
                 
                 return {"status": "out_of_stock", "message": "Produk tidak tersedia di semua toko"}
             
-            print(f"[DEBUG] Total variants found: {len(all_variants)}")
-            
-            # Check if product has any price history (to determine if it's a new product)
-            has_history = self.db.has_price_history(product_db_id)
+            logger.debug("Total variants found: %d", len(all_variants))
             
-            # IMPORTANT: Check if product was on sale BEFORE saving new price history
-            was_product_on_sale = self.db.was_product_on_sale(product_db_id) if has_history else False
+            # IMPORTANT: Read history/sale/notification state BEFORE saving new price history
+            check_state = await asyncio.to_thread(self.db.get_product_check_state, product_db_id)
+            has_history = check_state['has_history']
+            was_product_on_sale = check_state['was_on_sale']
             
-            # Collect all variants that are on sale, grouped by store
-            sale_variants_by_store = {}  # {store_id: [variants]}
+            # Record this check; only variants whose price/sale state changed get a history row
+            # (variants already carry every price_history column)
+            await asyncio.to_thread(self.db.record_product_check, product_db_id, all_variants)
             
-            # Check each variant and save price history
+            # Collect variants that are on sale, grouped by store
+            sale_variants_by_store = defaultdict(list)  # {store_id: [variants]}
+            # Base price and promo price range, gathered in the same pass
+            base_price = lowest_promo_price = highest_promo_price = None
+            total_sale_variants = 0  # Across all stores
             for variant in all_variants:
-                l2_id = variant['l2_id']
-                size_code = variant['size_code']
-                is_on_sale = variant['is_on_sale']
-                base_price = variant['base_price']
-                promo_price = variant['promo_price']
-                store_id = variant.get('store_id', 'unknown')
-                store_name = variant.get('store_name', 'Unknown Store')
-                
-                # Save current price
-                self.db.save_price_history(product_db_id, {
-                    'l2_id': l2_id,
-                    'size_code': size_code,
-                    'color_code': variant.get('color_code', ''),
-                    'store_id': store_id,
-                    'store_name': store_name,
-                    'base_price': base_price,
-                    'promo_price': promo_price,
-                    'is_on_sale': is_on_sale
-                })
+                if not variant.on_sale_effective:
+                    continue
                 
-                # Collect variants that are on sale, grouped by store
-                if is_on_sale and base_price > promo_price:
-                    if store_id not in sale_variants_by_store:
-                        sale_variants_by_store[store_id] = []
-                    sale_variants_by_store[store_id].append(variant)
-            
-            # Count total sale variants across all stores
-            total_sale_variants = sum(len(variants) for variants in sale_variants_by_store.values())
+                sale_variants_by_store[variant.store_id].append(variant)
+                total_sale_variants += 1
+                price = variant.promo_price
+                if base_price is None:
+                    base_price = variant.base_price
+                    lowest_promo_price = highest_promo_price = price
+                elif price < lowest_promo_price:
+                    lowest_promo_price = price
+                elif price > highest_promo_price:
+                    highest_promo_price = price
             
             # If sale ended (was on sale, now not on sale), clear notification flag
             if was_product_on_sale and total_sale_variants == 0:
-                self.db.clear_product_notification_flag(product_db_id)
+                await asyncio.to_thread(self.db.clear_product_notification_flag, product_db_id)
             
             # Only send notification if:
             # 1. Product has variants on sale in any store
@@ -267,54 +349,62 @@ class ProductMonitor:
                 # For new products (no history), was_product_on_sale will be False, so is_new_sale = True
                 is_new_sale = not was_product_on_sale
                 
-                # Get the lowest promo price from all sale variants across all stores
-                all_sale_variants = []
-                for variants in sale_variants_by_store.values():
-                    all_sale_variants.extend(variants)
-                lowest_promo_price = min(v['promo_price'] for v in all_sale_variants)
-                
-                # Check if should send notification (max 3 days, price drop logic)
-                should_send, reason = self.db.should_send_notification(product_db_id, lowest_promo_price)
+                # Check if should send notification (max 3 days, price drop logic).
+                # For a new sale the decision and the mark happen in one transaction.
+                reservation = None
+                if is_new_sale:
+                    should_send, reason, reservation = await asyncio.to_thread(
+                        self.db.reserve_notification, product_db_id, lowest_promo_price
+                    )
+                else:
+                    should_send, reason = self.db.should_send_notification(
+                        product_db_id, lowest_promo_price, check_state['notification_info']
+                    )
                 
-                print(f"[DEBUG] Product {product_db_id} ({product_name}):")
-                print(f"  - total_sale_variants: {total_sale_variants}")
-                print(f"  - stores_with_sale: {len(sale_variants_by_store)}")
-                print(f"  - has_history: {has_history}")
-                print(f"  - was_on_sale: {was_product_on_sale}")
-                print(f"  - is_new_sale: {is_new_sale}")
-                print(f"  - lowest_promo_price: {lowest_promo_price}")
-                print(f"  - should_send: {should_send}, reason: {reason}")
+                logger.debug(
+                    "Product %s (%s): total_sale_variants=%d stores_with_sale=%d has_history=%s "
+                    "was_on_sale=%s is_new_sale=%s lowest_promo_price=%s should_send=%s reason=%s",
+                    product_db_id, product_name, total_sale_variants, len(sale_variants_by_store),
+                    has_history, was_product_on_sale, is_new_sale, lowest_promo_price, should_send, reason
+                )
                 
                 # Send notification if:
                 # - It's a new sale (wasn't on sale before) OR it's a new product
                 # - And should_send is True (max 3 days, price drop logic)
                 if is_new_sale and should_send:
-                    print(f"[DEBUG] ✅ Sending notification for product {product_db_id} ({reason})")
+                    logger.debug("Sending notification for product %s (%s)", product_db_id, reason)
                     # Send ONE notification with all sale variants grouped by store
+                    # (already marked as notified with price by reserve_notification)
                     if bot:
-                        await self.send_sale_notification(
+                        sent = await self.send_sale_notification(
                             bot,
                             user_id,
                             product_name,
                             product_id,
-                            sale_variants_by_store
+                            sale_variants_by_store,
+                            user_store_ids,
+                            all_sizes,
+                            all_colors,
+                            base_price=base_price,
+                            lowest_promo_price=lowest_promo_price,
+                            highest_promo_price=highest_promo_price
                         )
-                    
-                    # Mark as notified with price (tracks consecutive days and price)
-                    self.db.mark_product_notification_sent(product_db_id, lowest_promo_price)
+                        if not sent:
+                            # Undo the mark so the next check retries the notification
+                            await asyncio.to_thread(self.db.release_notification, product_db_id, reservation)
                 else:
                     if not is_new_sale:
-                        print(f"[DEBUG] ❌ Not sending notification: not a new sale")
+                        logger.debug("Not sending notification: not a new sale")
                     else:
-                        print(f"[DEBUG] ❌ Not sending notification: {reason}")
+                        logger.debug("Not sending notification: %s", reason)
             else:
-                print(f"[DEBUG] Product {product_db_id}: No variants on sale in any store")
+                logger.debug("Product %s: No variants on sale in any store", product_db_id)
             
             # Return success status
             return {"status": "success", "has_sale": total_sale_variants > 0}
         
         except Exception as e:
-            print(f"Error checking product {product_db_id}: {e}")
+            logger.error("Error checking product %s: %s", product_db_id, e)
             return {"status": "error", "message": str(e)}
     
     async def send_sale_notification(
@@ -323,185 +413,55 @@ class ProductMonitor:
         user_id: int,
         product_name: str,
         product_id: str,
-        sale_variants_by_store: Dict[str, List[Dict]]
-    ):
-        """Send sale notification to user (ONE notification per product, grouped by store)"""
+        sale_variants_by_store: Dict[str, List[Variant]],
+        user_store_ids: List[str],
+        all_sizes: Set[str],
+        all_colors: Set[str],
+        *,
+        base_price: int,
+        lowest_promo_price: int,
+        highest_promo_price: int
+    ) -> bool:
+        """Send sale notification to user (ONE notification per product, grouped by store); returns True if sent"""
         try:
             if not sale_variants_by_store:
-                return
-            
-            # Format prices (assuming IDR)
-            def format_price(price):
-                return f"Rp {price:,}".replace(',', '.')
-            
-            # Get all variants for price calculation
-            all_variants = []
-            for variants in sale_variants_by_store.values():
-                all_variants.extend(variants)
-            
-            # Get min/max prices
-            base_price = all_variants[0]['base_price']
-            lowest_promo_price = min(v['promo_price'] for v in all_variants)
-            highest_promo_price = max(v['promo_price'] for v in all_variants)
+                return False
             
             # Calculate discount (based on lowest promo price)
             discount = base_price - lowest_promo_price
             discount_percent = int((discount / base_price) * 100)
             
-            # Get all sizes and colors from product (regardless of stock)
-            all_sizes = set()
-            all_colors = set()
-            
-            # Get from first store's product data
-            try:
-                user_store_ids = self.db.get_all_user_store_ids(user_id)
-                if not user_store_ids:
-                    from config import STORE_IDS
-                    user_store_ids = STORE_IDS
-                
-                if user_store_ids:
-                    first_store_id = user_store_ids[0]
-                    product_data = self.api.get_product_info(product_id, first_store_id)
-                    if product_data and isinstance(product_data, dict):
-                        l2s = product_data.get('l2s', [])
-                        # Size code mapping (same as parse_product_data)
-                        SIZE_CODE_MAP = {
-                            '00': 'FREE SIZE', '001': 'XXS', '002': 'XS', '003': 'S', '004': 'M', 
-                            '005': 'L', '006': 'XL', '007': 'XXL', '008': 'XXXL', '009': '4XL', '010': '5XL',
-                            '027': '27"', '028': '28"', '029': '29"', '030': '30"', '031': '31"', '032': '32"',
-                            '033': '33"', '034': '34"', '035': '35"', '036': '36"', '037': '37"', '038': '38"',
-                            '040': '40"', '042': '42"',
-                            '100': '100cm', '110': '110cm', '120': '120cm', '130': '130cm', 
-                            '140': '140cm', '150': '150cm', '160': '160cm',
-                        }
-                        
-                        for l2 in l2s:
-                            size_obj = l2.get('size', {})
-                            color_obj = l2.get('color', {})
-                            
-                            # Get size code
-                            display_code = size_obj.get('displayCode', '')
-                            full_size_code = size_obj.get('sizeCode', '')
-                            
-                            # Extract numeric part if needed
-                            if full_size_code and not display_code:
-                                import re
-                                match = re.search(r'(\d{2,3})$', full_size_code)
-                                if match:
-                                    display_code = match.group(1)
-                            
-                            size_code = display_code or full_size_code
-                            
-                            # Get size name using SIZE_CODE_MAP
-                            size_name = (
-                                size_obj.get('name') or 
-                                size_obj.get('displayName') or 
-                                size_obj.get('label') or
-                                SIZE_CODE_MAP.get(size_code, size_code)
-                            )
-                            if size_name:
-                                all_sizes.add(size_name)
-                            
-                            # Get color name (prefer name/displayName, avoid numeric displayCode)
-                            color_name = (
-                                color_obj.get('name') or 
-                                color_obj.get('displayName') or 
-                                color_obj.get('label')
-                            )
-                            # Skip numeric displayCode (like "32", "69") - use empty string instead
-                            if not color_name:
-                                display_code = color_obj.get('displayCode', '')
-                                # Only use displayCode if it's not numeric (e.g., "WHITE" not "32")
-                                if display_code and not display_code.isdigit():
-                                    color_name = display_code
-                            
-                            if color_name:
-                                all_colors.add(color_name)
-            except Exception as e:
-                print(f"[ERROR] Error getting all sizes/colors: {e}")
-            
             # Build message
-            message = (
-                "🎉 **PRODUK SEDANG SALE!**\n\n"
-                f"📦 **{product_name}**\n\n"
-                f"💰 **Harga Normal:** {format_price(base_price)}\n"
-                f"🔥 **Harga Sale:** {format_price(lowest_promo_price)}"
-            )
-            
+            promo_price = _format_price(lowest_promo_price)
             # Add price range if there are different prices across stores
             if lowest_promo_price != highest_promo_price:
-                message += f" - {format_price(highest_promo_price)}"
+                promo_price += f" - {_format_price(highest_promo_price)}"
             
-            message += f"\n💸 **Diskon:** {format_price(discount)} ({discount_percent}%)\n\n"
+            # Message is built as a list of fragments and joined once at the end
+            parts = [_SALE_HEADER_TPL.format(
+                product_name=product_name,
+                base_price=_format_price(base_price),
+                promo_price=promo_price,
+                discount=_format_price(discount),
+                discount_percent=discount_percent
+            )]
             
             # Add all sizes and colors
             if all_sizes or all_colors:
-                message += f"🌐 **Tersedia di Offline dan Online Store:**\n"
+                parts.append("🌐 **Tersedia di Offline dan Online Store:**\n")
                 if all_sizes:
                     sizes_str = ", ".join(sorted(all_sizes))
-                    message += f"📏 **Size:** {sizes_str}\n"
+                    parts.append(f"📏 **Size:** {sizes_str}\n")
                 if all_colors:
                     colors_str = ", ".join(sorted(all_colors))
-                    message += f"🎨 **Warna:** {colors_str}\n"
-                message += "\n"
-            
-            # Get all monitored stores
-            user_store_ids = self.db.get_all_user_store_ids(user_id)
-            if not user_store_ids:
-                from config import STORE_IDS
-                user_store_ids = STORE_IDS
+                    parts.append(f"🎨 **Warna:** {colors_str}\n")
+                parts.append("\n")
             
             # Get store names for all monitored stores
-            all_store_info = {}
-            for store_id in user_store_ids:
-                try:
-                    store_info = self.api.get_store_info(store_id)
-                    if store_info and isinstance(store_info, dict):
-                        store_name = store_info.get('name', f'Store {store_id}')
-                    else:
-                        store_name = f'Store {store_id}'
-                    all_store_info[store_id] = store_name
-                except Exception as e:
-                    print(f"[ERROR] Error getting store info for {store_id}: {e}")
-                    all_store_info[store_id] = f'Store {store_id}'
+            all_store_info = await self._get_store_names(user_store_ids)
             
             # Add store-specific info (show ALL stores, available and not available)
-            message += "🏪 **Toko:**\n"
-            
-            # Smart size sorting function
-            def sort_size(size_str):
-                # Standard sizes
-                size_order = {
-                    'FREE SIZE': -1, 'XXS': 0, 'XS': 1, 'S': 2, 'M': 3, 
-                    'L': 4, 'XL': 5, 'XXL': 6, 'XXXL': 7, '4XL': 8, '5XL': 9
-                }
-                
-                size_upper = size_str.upper()
-                
-                # If it's a standard size, use the predefined order
-                if size_upper in size_order:
-                    return (0, size_order[size_upper])
-                
-                # If it's an inch size (e.g., 27", 28", etc.)
-                if '"' in size_str or 'INCH' in size_upper:
-                    import re
-                    match = re.search(r'(\d+)', size_str)
-                    if match:
-                        return (1, int(match.group(1)))
-                
-                # If it's a cm size (e.g., 100cm, 110cm, etc.)
-                if 'CM' in size_upper:
-                    import re
-                    match = re.search(r'(\d+)', size_str)
-                    if match:
-                        return (2, int(match.group(1)))
-                
-                # If it's a pure number (e.g., 027, 028, etc.)
-                if size_str.isdigit():
-                    return (3, int(size_str))
-                
-                # Default: alphabetical
-                return (99, size_str)
+            parts.append("🏪 **Toko:**\n")
             
             # Show all stores
             for store_id in user_store_ids:
@@ -510,65 +470,120 @@ class ProductMonitor:
                 if store_id in sale_variants_by_store:
                     # Store has stock
                     variants = sale_variants_by_store[store_id]
-                    sizes_on_sale = [v.get('size_name', v.get('size_code', '')) for v in variants]
-                    sorted_sizes = sorted(set(sizes_on_sale), key=sort_size)
-                    sizes_text = ", ".join(sorted_sizes)
-                    store_promo_price = variants[0]['promo_price']
+                    sizes_text = _join_sizes(frozenset(v.size_name or v.size_code for v in variants))
+                    store_promo_price = variants[0].promo_price
                     
-                    message += f"\n• **{store_name}** ✅\n"
-                    message += f"  📏 Size: {sizes_text}\n"
-                    message += f"  💰 Harga: {format_price(store_promo_price)}\n"
+                    parts.append(_STORE_SALE_TPL.format(
+                        store_name=store_name, sizes=sizes_text, price=_format_price(store_promo_price)
+                    ))
                 else:
                     # Store doesn't have stock
-                    message += f"\n• **{store_name}** ❌\n"
-                    message += f"  📏 Size: Tidak tersedia\n"
+                    parts.append(_STORE_NO_STOCK_TPL.format(store_name=store_name))
             
-            message += f"\n⏰ {datetime.now().strftime('%d/%m/%Y %H:%M')}"
+            parts.append(f"\n⏰ {datetime.now().strftime('%d/%m/%Y %H:%M')}")
             
             await bot.send_message(
                 chat_id=user_id,
-                text=message,
+                text="".join(parts),
                 parse_mode=ParseMode.MARKDOWN
             )
+            return True
             
         except Exception as e:
-            print(f"Error sending notification: {e}")
+            logger.error("Error sending notification: %s", e)
+            return False
     
     async def check_all_products(self, bot: Bot):
         """Check all products being monitored"""
-        products = self.db.get_all_products()
+        # Price history is a change log; drop entries past the retention window
+        await asyncio.to_thread(self.db.cleanup_old_price_history, PRICE_HISTORY_RETENTION_DAYS)
+        
+        products = await asyncio.to_thread(self.db.get_all_products)
+        # One query for every user's stores instead of one per product
+        store_ids_by_user = await asyncio.to_thread(self.db.get_store_ids_by_user)
         
-        for product in products:
+        # Warm the store-info cache once for every store this sweep touches,
+        # so the per-product checks below only read cached store names
+        sweep_store_ids = {
+            store_id
+            for product in products
+            for store_id in (store_ids_by_user.get(product['user_id']) or STORE_IDS)
+        }
+        await self._get_store_names(list(sweep_store_ids))
+        # Checks run concurrently; API pacing is handled by self.api_limiter
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_CHECKS)
+        
+        async def check_one(product):
+            user_id = product['user_id']
+            async with semaphore:
+                await self.check_product(
+                    product['id'], user_id, bot, product, store_ids_by_user.get(user_id, [])
+                )
+        
+        results = await asyncio.gather(
+            *[check_one(product) for product in products],
+            return_exceptions=True
+        )
+        for product, result in zip(products, results):
+            if isinstance(result, Exception):
+                logger.error("Error checking product %s: %s", product['id'], result)
+        logger.debug("Database pool after sweep: %s", self.db.pool_stats())
+    
+    async def _run_forever(self, bot: Bot):
+        """Check all products every CHECK_INTERVAL_MINUTES until monitoring stops"""
+        loop = asyncio.get_running_loop()
+        interval = CHECK_INTERVAL_MINUTES * 60
+        next_run = loop.time() + interval  # First check after one interval
+        while self.monitoring:
+            await asyncio.sleep(max(0, next_run - loop.time()))
+            # Fixed-rate schedule: a slow sweep doesn't push back the following ones
+            next_run += interval
+            started = loop.time()
             try:
-                await self.check_product(product['id'], product['user_id'], bot)
-                # Small delay between checks
-                await asyncio.sleep(2)
+                await self.check_all_products(bot)
             except Exception as e:
-                print(f"Error checking product {product['id']}: {e}")
+                logger.error("Error in monitoring task: %s", e)
+            
+            duration = loop.time() - started
+            self.sweep_duration_ewma = (
+                duration if self.sweep_duration_ewma is None
+                else 0.3 * duration + 0.7 * self.sweep_duration_ewma
+            )
+            
+            # Overran the interval: skip the missed ticks instead of running sweeps back to back
+            now = loop.time()
+            if next_run <= now:
+                skipped = int((now - next_run) // interval) + 1
+                next_run += skipped * interval
+                logger.warning(
+                    "Sweep took %.0fs (interval %ds), skipping %d tick(s)", duration, interval, skipped
+                )
+            if self.sweep_duration_ewma > interval * 0.8:
+                logger.warning(
+                    "Sweeps average %.0fs, close to the %ds interval; consider raising "
+                    "CHECK_INTERVAL_MINUTES or MAX_CONCURRENT_CHECKS",
+                    self.sweep_duration_ewma, interval
+                )
     
     def start_monitoring(self, application):
-        """Start periodic monitoring task"""
+        """Start periodic monitoring task (must be called from the running event loop, e.g. post_init)"""
         if self.monitoring:
             return
         
         self.monitoring = True
+        self._monitor_task = asyncio.create_task(self._run_forever(application.bot))
+        logger.info("Monitoring started - checking every %d minutes", CHECK_INTERVAL_MINUTES)
+    
+    async def stop_monitoring(self):
+        """Stop the periodic monitoring task and wait for it to finish"""
+        if not self.monitoring:
+            return
         
-        async def monitoring_task(context):
-            try:
-                bot = context.bot
-                await self.check_all_products(bot)
-            except Exception as e:
-                print(f"Error in monitoring task: {e}")
-        
-        # Use job queue for periodic task
-        job_queue = application.job_queue
-        if job_queue:
-            job_queue.run_repeating(
-                monitoring_task,
-                interval=CHECK_INTERVAL_MINUTES * 60,
-                first=CHECK_INTERVAL_MINUTES * 60
-            )
-            print(f"Monitoring started - checking every {CHECK_INTERVAL_MINUTES} minutes")
-        else:
-            print("Warning: Job queue not available, monitoring may not work properly")
+        self.monitoring = False
+        self._monitor_task.cancel()
+        try:
+            await self._monitor_task
+        except asyncio.CancelledError:
+            pass
+        self._monitor_task = None
 
@@ -0,0 +1,79 @@
+import asyncio
+import time
+from collections import deque
+from typing import Optional
+
+
+class RateLimiter:
+    """Async sliding-window rate limiter: at most max_rate acquisitions per time_period seconds
+
+    Usage:
+        limiter = RateLimiter(25, 1)
+        async with limiter:
+            await bot.send_message(...)
+    """
+
+    def __init__(self, max_rate: int, time_period: float = 1.0):
+        self.max_rate = max_rate
+        self.time_period = time_period
+        self._timestamps = deque()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a slot is free in the current window"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                while self._timestamps and now - self._timestamps[0] >= self.time_period:
+                    self._timestamps.popleft()
+
+                if len(self._timestamps) < self.max_rate:
+                    self._timestamps.append(now)
+                    return
+
+                await asyncio.sleep(self.time_period - (now - self._timestamps[0]))
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+
+class AdaptiveRateLimiter(RateLimiter):
+    """RateLimiter that adapts its rate to server feedback (AIMD)
+
+    Each successful response raises the rate by `increase` (up to `ceiling`);
+    a 429/5xx response multiplies it by `decrease` (down to `floor`) and a
+    Retry-After hint pauses all acquisitions until it has passed.
+    record_response only assigns plain attributes, so it may be called from
+    worker threads.
+    """
+
+    def __init__(self, ceiling: int, time_period: float = 1.0, floor: int = 1,
+                 increase: float = 0.5, decrease: float = 0.5):
+        super().__init__(ceiling, time_period)
+        self.ceiling = ceiling
+        self.floor = floor
+        self.increase = increase
+        self.decrease = decrease
+        self.rate = float(ceiling)
+        self._paused_until = 0.0
+
+    def record_response(self, status_code: int, retry_after: Optional[float] = None):
+        """Adjust the rate after a response"""
+        if status_code == 429 or status_code >= 500:
+            self.rate = max(self.floor, self.rate * self.decrease)
+            if retry_after:
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+        else:
+            self.rate = min(self.ceiling, self.rate + self.increase)
+        self.max_rate = max(1, int(self.rate))
+
+    async def acquire(self):
+        """Wait out any server-requested pause, then a slot in the current window"""
+        delay = self._paused_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await super().acquire()
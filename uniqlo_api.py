@@ -1,8 +1,99 @@
+import html
+import json
+import logging
+import random
 import requests
 import re
-from typing import Dict, List, Optional
+import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Dict, List, Optional, Tuple
 from urllib.parse import urlparse, parse_qs
-from config import UNIQLO_API_BASE, UNIQLO_BASE_URL
+from config import (
+    UNIQLO_API_BASE, UNIQLO_BASE_URL, MAX_CONCURRENT_CHECKS, API_MAX_RETRIES, API_MAX_RETRY_DELAY
+)
+from cache import TTLCache
+from models import Variant
+
+try:
+    import orjson  # Optional: several times faster than json for the l2s/stores payloads
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+logger = logging.getLogger(__name__)
+
+# Mapping displayCode/sizeCode to size name
+SIZE_CODE_MAP = {
+    # Standard sizes
+    '00': 'FREE SIZE',
+    '001': 'XXS',
+    '002': 'XS',
+    '003': 'S',
+    '004': 'M',
+    '005': 'L',
+    '006': 'XL',
+    '007': 'XXL',
+    '008': 'XXXL',
+    '009': '4XL',
+    '010': '5XL',
+    # Inch sizes (pants/jeans)
+    '027': '27"',
+    '028': '28"',
+    '029': '29"',
+    '030': '30"',
+    '031': '31"',
+    '032': '32"',
+    '033': '33"',
+    '034': '34"',
+    '035': '35"',
+    '036': '36"',
+    '037': '37"',
+    '038': '38"',
+    '040': '40"',
+    '042': '42"',
+    # Kids sizes
+    '100': '100cm',
+    '110': '110cm',
+    '120': '120cm',
+    '130': '130cm',
+    '140': '140cm',
+    '150': '150cm',
+    '160': '160cm',
+}
+
+# Product ID with color code in a product URL (e.g., /products/E479678-000/00)
+_PRODUCT_ID_RE = re.compile(r'/products/([A-Z0-9]+-\d{3})')
+# <title> of a product page; only the start of the HTML is downloaded to find it
+_TITLE_RE = re.compile(rb'<title[^>]*>([^<]+)</title>', re.IGNORECASE)
+_TITLE_MAX_BYTES = 65536
+# Stock statuses that count as available when quantity > 0
+_IN_STOCK_STATUSES = frozenset(('IN_STOCK', 'LOW_STOCK'))
+# Shared read-only default for missing nested objects in API responses
+_EMPTY: Dict = {}
+
+def parse_size(size_obj: Dict) -> Tuple[str, str]:
+    """Return (size_code, size_name) for an l2 'size' object"""
+    # Prefer displayCode, fallback to the numeric part of sizeCode (e.g., INS027 → 027)
+    size_code = size_obj.get('displayCode', '')
+    if not size_code:
+        full_size_code = size_obj.get('sizeCode', '')
+        size_code = full_size_code
+        # Trailing 3 or 2 digits; slicing is cheaper than a regex here
+        for width in (3, 2):
+            tail = full_size_code[-width:]
+            if len(tail) == width and tail.isdecimal():
+                size_code = tail
+                break
+    
+    # Try multiple fields to get size name
+    size_name = (
+        size_obj.get('name') or 
+        size_obj.get('displayName') or 
+        size_obj.get('label') or 
+        SIZE_CODE_MAP.get(size_code, size_code)
+    )
+    return size_code, size_name
 
 class UniqloAPI:
     def __init__(self):
@@ -14,6 +105,74 @@ class UniqloAPI:
             'Accept-Language': 'en-US,en;q=0.9',
             'X-Fr-Clientid': 'uq.id.web-spa'
         })
+        
+        # Keep enough pooled keep-alive connections for every worker thread that may share the
+        # session (asyncio.to_thread's default executor tops out at 32 threads). Dropped or refused
+        # connections are retried here; 429/5xx responses are retried by _get with Retry-After
+        retry = Retry(
+            total=3, connect=3, read=0, status=0, other=0,
+            backoff_factor=0.3, allowed_methods=frozenset(['GET'])
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(32, MAX_CONCURRENT_CHECKS * 4), max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        
+        # Store metadata rarely changes; shared by the bot handlers and the monitor
+        self.store_info_cache = TTLCache(maxsize=1024, ttl=86400)
+        # {(color displayCode, size displayCode): l2_id} per product; variant IDs are stable
+        self.l2_id_cache = TTLCache(maxsize=512, ttl=300)
+        # {store_id: stockStatus} of a variant per (l2_id, keyword); short-lived, stock moves quickly
+        self.store_stock_cache = TTLCache(maxsize=1024, ttl=60)
+        
+        # Optional callback(status_code, retry_after_seconds) fed after every API response
+        self.on_response = None
+    
+    def close(self):
+        """Close pooled HTTP connections"""
+        self.session.close()
+    
+    def _get(self, url: str, params: Dict = None, timeout: float = 10) -> requests.Response:
+        """GET an API URL with the shared session, retrying 429/5xx with backoff; reports each status to on_response"""
+        for attempt in range(API_MAX_RETRIES + 1):
+            response = self.session.get(url, params=params, timeout=timeout)
+            retry_after = response.headers.get('Retry-After')
+            try:
+                retry_after = float(retry_after) if retry_after else None
+            except ValueError:
+                retry_after = None  # HTTP-date form; fall back to exponential backoff
+            if self.on_response is not None:
+                self.on_response(response.status_code, retry_after)
+            
+            status = response.status_code
+            if (status != 429 and status < 500) or attempt == API_MAX_RETRIES:
+                return response
+            
+            # Honor Retry-After when given, else jittered exponential backoff (1-2s, 2-3s, 4-5s)
+            delay = retry_after if retry_after is not None else 2 ** attempt + random.random()
+            logger.debug("HTTP %s from %s, retrying in %.1fs (attempt %d/%d)",
+                         status, url, delay, attempt + 1, API_MAX_RETRIES)
+            time.sleep(min(delay, API_MAX_RETRY_DELAY))
+        return response
+    
+    def _fetch_l2s(self, product_id: str, store_id: str = None) -> Optional[Dict]:
+        """GET a product's variants with prices and stock (online stock when store_id is None)"""
+        url = f"{self.base_url}/products/{product_id}/price-groups/00/l2s"
+        params = {
+            'withPrices': 'true',
+            'withStocks': 'true',
+            'includePreviousPrice': 'false',
+            'httpFailure': 'true'
+        }
+        if store_id:
+            params['storeId'] = store_id
+        
+        response = self._get(url, params)
+        response.raise_for_status()
+        data = _loads(response.content)
+        
+        if data.get('status') == 'ok' and 'result' in data:
+            return data['result']
+        return None
     
     def extract_product_id_from_url(self, url: str) -> Optional[str]:
         """Extract product ID from Uniqlo product URL
@@ -23,45 +182,38 @@ class UniqloAPI:
         """
         # Pattern: /id/id/products/{PRODUCT_ID}-{COLOR_CODE}/{SIZE_CODE}
         # Example: /id/id/products/E479678-000/00
-        pattern = r'/products/([A-Z0-9]+-\d{3})'
-        match = re.search(pattern, url)
+        match = _PRODUCT_ID_RE.search(url)
         if match:
             product_id = match.group(1)  # E479678-000
-            print(f"[EXTRACT] Product ID: {product_id}")
+            logger.debug("[EXTRACT] Product ID: %s", product_id)
             return product_id
         return None
     
     def get_l2_id_from_color_size(self, product_id: str, color_display_code: str, size_display_code: str) -> Optional[str]:
         """Get l2_id (variant ID) from colorDisplayCode and sizeDisplayCode"""
         try:
-            # Get product data to find matching l2_id
-            url = f"{self.base_url}/products/{product_id}/price-groups/00/l2s"
-            params = {
-                'withPrices': 'true',
-                'withStocks': 'true',
-                'includePreviousPrice': 'false',
-                'httpFailure': 'true'
-            }
-            
-            response = self.session.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            
-            if data.get('status') == 'ok' and 'result' in data:
-                l2s = data['result'].get('l2s', [])
-                for l2 in l2s:
+            # One /l2s fetch maps every color/size of the product; reuse it for a few minutes
+            l2_ids = self.l2_id_cache.get(product_id)
+            if l2_ids is None:
+                result = self._fetch_l2s(product_id)
+                if result is None:
+                    return None
+                
+                l2_ids = {}
+                for l2 in result.get('l2s', []):
                     color_code = l2.get('color', {}).get('displayCode', '')
                     size_code = l2.get('size', {}).get('displayCode', '')
-                    
-                    if color_code == color_display_code and size_code == size_display_code:
-                        l2_id = l2.get('l2Id')
-                        print(f"[L2_ID] Found l2_id={l2_id} for color={color_display_code}, size={size_display_code}")
-                        return l2_id
-                
-                print(f"[L2_ID] No matching l2_id found for color={color_display_code}, size={size_display_code}")
-            return None
+                    l2_ids.setdefault((color_code, size_code), l2.get('l2Id'))  # First match wins
+                self.l2_id_cache.set(product_id, l2_ids)
+            
+            l2_id = l2_ids.get((color_display_code, size_display_code))
+            if l2_id:
+                logger.debug("[L2_ID] Found l2_id=%s for color=%s, size=%s", l2_id, color_display_code, size_display_code)
+            else:
+                logger.debug("[L2_ID] No matching l2_id found for color=%s, size=%s", color_display_code, size_display_code)
+            return l2_id
         except Exception as e:
-            print(f"[ERROR] Error getting l2_id from color/size: {e}")
+            logger.error("Error getting l2_id from color/size: %s", e)
             return None
     
     def check_store_stock_by_color_size(self, product_id: str, color_display_code: str, size_display_code: str, store_id: str) -> Optional[str]:
@@ -78,31 +230,16 @@ class UniqloAPI:
             # Use existing endpoint to check store stock
             return self.get_store_specific_stock(l2_id, store_id)
         except Exception as e:
-            print(f"[ERROR] Error checking store stock by color/size: {e}")
+            logger.error("Error checking store stock by color/size: %s", e)
             return None
     
     def get_product_info(self, product_id: str, store_id: str = "113757") -> Optional[Dict]:
         """Get product information including prices and stock"""
         try:
             # Get product prices and stock
-            url = f"{self.base_url}/products/{product_id}/price-groups/00/l2s"
-            params = {
-                'withPrices': 'true',
-                'withStocks': 'true',
-                'storeId': store_id,
-                'includePreviousPrice': 'false',
-                'httpFailure': 'true'
-            }
-            
-            response = self.session.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            
-            if data.get('status') == 'ok' and 'result' in data:
-                return data['result']
-            return None
+            return self._fetch_l2s(product_id, store_id)
         except Exception as e:
-            print(f"Error fetching product info: {e}")
+            logger.error("Error fetching product info: %s", e)
             return None
     
     def get_store_specific_stock(self, l2_id: str, store_id: str, keyword: str = None) -> Optional[str]:
@@ -116,12 +253,30 @@ class UniqloAPI:
         
         Returns: 'IN_STOCK', 'LOW_STOCK', 'OUT_OF_STOCK', or None
         """
+        stock_by_store = self._fetch_stores_for_l2(l2_id, keyword)
+        if stock_by_store is None:
+            return None
+        
+        stock_status = stock_by_store.get(store_id)
+        if stock_status is None:
+            logger.debug("[STORE_STOCK_CHECK] Store %s not found in response", store_id)
+        else:
+            logger.debug("[STORE_STOCK_CHECK] Found store %s: stockStatus=%s", store_id, stock_status)
+        return stock_status
+    
+    def _fetch_stores_for_l2(self, l2_id: str, keyword: str = None, limit: int = 50) -> Optional[Dict[str, str]]:
+        """Get {store_id: stockStatus} for a variant from one /l2s/{l2_id}/stores request; None on failure"""
+        cache_key = (l2_id, keyword)
+        stock_by_store = self.store_stock_cache.get(cache_key)
+        if stock_by_store is not None:
+            return stock_by_store
+        
         try:
             url = f"{self.base_url}/l2s/{l2_id}/stores"
             params = {
                 'unit': 'km',
                 'priceGroup': '00',
-                'limit': '50',  # Get up to 50 stores
+                'limit': str(limit),
                 'httpFailure': 'true'
             }
             
@@ -129,31 +284,31 @@ class UniqloAPI:
             if keyword:
                 params['keyword'] = keyword
             
-            response = self.session.get(url, params=params, timeout=10)
+            response = self._get(url, params)
             response.raise_for_status()
-            data = response.json()
+            data = _loads(response.content)
             
-            if data.get('status') == 'ok' and 'result' in data:
-                stores = data['result'].get('stores', [])
-                print(f"[STORE_STOCK_CHECK] l2_id={l2_id}, found {len(stores)} stores in response")
-                
-                # Find the specific store
-                for store in stores:
-                    store_id_match = store.get('storeId') or store.get('g1ImsStoreId6')
-                    if store_id_match == store_id:
-                        stock_status = store.get('stockStatus', 'OUT_OF_STOCK')
-                        store_name = store.get('storeName', f'Store {store_id}')
-                        print(f"[STORE_STOCK_CHECK] ✅ Found store {store_id} ({store_name}): stockStatus={stock_status}")
-                        return stock_status
-                
-                print(f"[STORE_STOCK_CHECK] ❌ Store {store_id} not found in response")
-            return None
+            if data.get('status') != 'ok' or 'result' not in data:
+                return None
+            
+            stores = data['result'].get('stores', [])
+            logger.debug("[STORE_STOCK_CHECK] l2_id=%s, found %d stores in response", l2_id, len(stores))
+            stock_by_store = {
+                (store.get('storeId') or store.get('g1ImsStoreId6')): store.get('stockStatus', 'OUT_OF_STOCK')
+                for store in stores
+            }
+            self.store_stock_cache.set(cache_key, stock_by_store)
+            return stock_by_store
         except Exception as e:
-            print(f"[ERROR] Error fetching store-specific stock for l2={l2_id}, store={store_id}: {e}")
+            logger.error("Error fetching store stock for l2=%s: %s", l2_id, e)
             return None
     
     def get_store_info(self, store_id: str) -> Optional[Dict]:
-        """Get store information"""
+        """Get store information (cached for a day)"""
+        store_info = self.store_info_cache.get(store_id)
+        if store_info is not None:
+            return store_info
+        
         try:
             url = f"{self.base_url}/stores/{store_id}"
             params = {
@@ -161,15 +316,16 @@ class UniqloAPI:
                 'httpFailure': 'true'
             }
             
-            response = self.session.get(url, params=params, timeout=10)
+            response = self._get(url, params)
             response.raise_for_status()
-            data = response.json()
+            data = _loads(response.content)
             
             if data.get('status') == 'ok' and 'result' in data:
+                self.store_info_cache.set(store_id, data['result'])
                 return data['result']
             return None
         except Exception as e:
-            print(f"Error fetching store info: {e}")
+            logger.error("Error fetching store info: %s", e)
             return None
     
     def check_online_availability(self, product_id: str) -> Dict:
@@ -177,68 +333,27 @@ class UniqloAPI:
         try:
             # Get product info WITHOUT storeId to check online availability (NOT store-specific)
             # This endpoint without storeId returns online store stock
-            url = f"{self.base_url}/products/{product_id}/price-groups/00/l2s"
-            params = {
-                'withPrices': 'true',
-                'withStocks': 'true',
-                'includePreviousPrice': 'false',
-                'httpFailure': 'true'
-            }
+            logger.debug("[ONLINE_CHECK] Checking online availability for product %s", product_id)
+            result = self._fetch_l2s(product_id)
             
-            print(f"[ONLINE_CHECK] Checking online availability for product {product_id}")
-            response = self.session.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            
-            if data.get('status') != 'ok' or 'result' not in data:
-                print(f"[ONLINE_CHECK] Product not found in online store")
+            if result is None:
+                logger.debug("[ONLINE_CHECK] Product not found in online store")
                 return {'available': False, 'reason': 'product_not_found', 'sizes': []}
             
-            result = data['result']
             stocks = result.get('stocks', {})
             l2s = result.get('l2s', [])
-            print(f"[ONLINE_CHECK] Found {len(stocks)} variants in API response")
-            
-            # Size code mapping (same as parse_product_data)
-            SIZE_CODE_MAP = {
-                '00': 'FREE SIZE', '001': 'XXS', '002': 'XS', '003': 'S', '004': 'M', 
-                '005': 'L', '006': 'XL', '007': 'XXL', '008': 'XXXL', '009': '4XL', '010': '5XL',
-                '027': '27"', '028': '28"', '029': '29"', '030': '30"', '031': '31"', '032': '32"',
-                '033': '33"', '034': '34"', '035': '35"', '036': '36"', '037': '37"', '038': '38"',
-                '040': '40"', '042': '42"',
-                '100': '100cm', '110': '110cm', '120': '120cm', '130': '130cm', 
-                '140': '140cm', '150': '150cm', '160': '160cm',
-            }
+            logger.debug("[ONLINE_CHECK] Found %d variants in API response", len(stocks))
+            # Checked once: skips the per-variant debug calls when DEBUG is off
+            debug = logger.isEnabledFor(logging.DEBUG)
             
             # Map l2_id to size name
             l2_to_size = {}
             for l2 in l2s:
                 l2_id = l2.get('l2Id')
-                size_obj = l2.get('size', {})
-                
-                # Get size code (prefer displayCode, fallback to sizeCode)
-                display_code = size_obj.get('displayCode', '')
-                full_size_code = size_obj.get('sizeCode', '')
-                
-                # Extract numeric part from sizeCode if needed
-                if full_size_code and not display_code:
-                    import re
-                    match = re.search(r'(\d{2,3})$', full_size_code)
-                    if match:
-                        display_code = match.group(1)
-                
-                size_code = display_code or full_size_code
-                
-                # Try to get size name from multiple fields
-                size_name = (
-                    size_obj.get('name') or 
-                    size_obj.get('displayName') or 
-                    size_obj.get('label') or 
-                    SIZE_CODE_MAP.get(size_code, size_code)
-                )
-                
+                size_code, size_name = parse_size(l2.get('size', {}))
                 l2_to_size[l2_id] = size_name
-                print(f"[ONLINE_CHECK_SIZE] l2_id={l2_id}, size_code={size_code}, size_name={size_name}")
+                if debug:
+                    logger.debug("[ONLINE_CHECK_SIZE] l2_id=%s, size_code=%s, size_name=%s", l2_id, size_code, size_name)
             
             # Check if any variant has online stock
             online_variants = []
@@ -247,15 +362,16 @@ class UniqloAPI:
                 stock_status = stock_info.get('statusCode', '')
                 stock_quantity = stock_info.get('quantity', 0)
                 
-                print(f"[ONLINE_CHECK] l2_id={l2_id}, status={stock_status}, quantity={stock_quantity}")
+                if debug:
+                    logger.debug("[ONLINE_CHECK] l2_id=%s, status=%s, quantity=%s", l2_id, stock_status, stock_quantity)
                 
                 # Check if available online (either IN_STOCK or LOW_STOCK with quantity > 0)
-                if stock_quantity > 0 and stock_status in ['IN_STOCK', 'LOW_STOCK']:
+                if stock_quantity > 0 and stock_status in _IN_STOCK_STATUSES:
                     online_variants.append(l2_id)
                     size_name = l2_to_size.get(l2_id, 'Unknown')
                     online_sizes.append(size_name)
             
-            print(f"[ONLINE_CHECK] Result: {len(online_variants)} variants available online - Sizes: {', '.join(online_sizes)}")
+            logger.debug("[ONLINE_CHECK] Result: %d variants available online - Sizes: %s", len(online_variants), online_sizes)
             
             return {
                 'available': len(online_variants) > 0,
@@ -264,7 +380,7 @@ class UniqloAPI:
                 'reason': 'available' if online_variants else 'out_of_stock'
             }
         except Exception as e:
-            print(f"[ERROR] Error checking online availability: {e}")
+            logger.error("Error checking online availability: %s", e)
             return {'available': False, 'reason': 'error', 'error': str(e), 'sizes': []}
     
     def search_stores_by_product(self, l2_id: str, keyword: str = None, limit: int = 20) -> List[Dict]:
@@ -281,9 +397,9 @@ class UniqloAPI:
             if keyword:
                 params['keyword'] = keyword
             
-            response = self.session.get(url, params=params, timeout=10)
+            response = self._get(url, params)
             response.raise_for_status()
-            data = response.json()
+            data = _loads(response.content)
             
             if data.get('status') == 'ok' and 'result' in data:
                 result = data['result']
@@ -304,7 +420,7 @@ class UniqloAPI:
                 return formatted_stores
             return []
         except Exception as e:
-            print(f"Error searching stores by product: {e}")
+            logger.error("Error searching stores by product: %s", e)
             return []
     
     def search_stores(self, city: str = None) -> List[Dict]:
@@ -324,132 +440,88 @@ class UniqloAPI:
                 'httpFailure': 'true'
             }
             
-            response = self.session.get(url, params=params, timeout=10)
+            response = self._get(url, params)
             response.raise_for_status()
-            data = response.json()
+            data = _loads(response.content)
             
             if data.get('status') == 'ok' and 'result' in data:
                 return data['result']
             return []
         except Exception as e:
-            print(f"Error searching stores: {e}")
+            logger.error("Error searching stores: %s", e)
             return []
     
-    def parse_product_data(self, product_data: Dict, store_name: str = "Uniqlo") -> List[Dict]:
-        """Parse product data into a list of variants with prices"""
+    def parse_product_data(self, product_data: Dict, store_name: str = "Uniqlo", store_id: str = None) -> List[Variant]:
+        """Parse product data into a list of in-stock variants with prices"""
         variants = []
         
         if not product_data:
             return variants
         
-        # Mapping displayCode/sizeCode to size name
-        SIZE_CODE_MAP = {
-            # Standard sizes
-            '00': 'FREE SIZE',
-            '001': 'XXS',
-            '002': 'XS',
-            '003': 'S',
-            '004': 'M',
-            '005': 'L',
-            '006': 'XL',
-            '007': 'XXL',
-            '008': 'XXXL',
-            '009': '4XL',
-            '010': '5XL',
-            # Inch sizes (pants/jeans)
-            '027': '27"',
-            '028': '28"',
-            '029': '29"',
-            '030': '30"',
-            '031': '31"',
-            '032': '32"',
-            '033': '33"',
-            '034': '34"',
-            '035': '35"',
-            '036': '36"',
-            '037': '37"',
-            '038': '38"',
-            '040': '40"',
-            '042': '42"',
-            # Kids sizes
-            '100': '100cm',
-            '110': '110cm',
-            '120': '120cm',
-            '130': '130cm',
-            '140': '140cm',
-            '150': '150cm',
-            '160': '160cm',
-        }
-        
-        l2s = product_data.get('l2s', [])
-        prices = product_data.get('prices', {})
-        stocks = product_data.get('stocks', {})
+        l2s = product_data.get('l2s', ())
+        prices = product_data.get('prices', _EMPTY)
+        stocks = product_data.get('stocks', _EMPTY)
+        # Checked once: skips building per-variant debug arguments when DEBUG is off
+        debug = logger.isEnabledFor(logging.DEBUG)
+        append = variants.append
         
         for l2 in l2s:
             l2_id = l2.get('l2Id')
-            size_obj = l2.get('size', {})
-            
-            # Get size code (prefer displayCode, fallback to sizeCode)
-            display_code = size_obj.get('displayCode', '')
-            full_size_code = size_obj.get('sizeCode', '')  # e.g., INS027
+            stock_info = stocks.get(l2_id, _EMPTY)
+            stock_status = stock_info.get('statusCode', '')
+            stock_quantity = stock_info.get('quantity', 0)  # Get actual stock quantity
             
-            # Extract numeric part from sizeCode if exists (e.g., INS027 → 027)
-            if full_size_code and not display_code:
-                # Extract last 3 digits from codes like INS027, INS028, etc.
-                import re
-                match = re.search(r'(\d{2,3})$', full_size_code)
-                if match:
-                    display_code = match.group(1)
+            # Include variants with actual stock (quantity > 0) and status IN_STOCK or LOW_STOCK
+            # LOW_STOCK with quantity > 0 means still available
+            # STOCK_OUT or quantity = 0 means not available
+            in_stock = stock_quantity > 0 and stock_status in _IN_STOCK_STATUSES
+            if not in_stock and not debug:
+                continue  # Nothing else about the variant is needed
             
-            size_code = display_code or full_size_code
+            size_obj = l2.get('size', _EMPTY)
+            size_code, size_name = parse_size(size_obj)
             
             # Debug: Log size extraction
-            print(f"[SIZE_DEBUG] l2_id={l2_id}, displayCode={display_code}, sizeCode={full_size_code}, final_size_code={size_code}")
-            print(f"[SIZE_DEBUG] size_obj fields: name={size_obj.get('name')}, displayName={size_obj.get('displayName')}, label={size_obj.get('label')}")
+            if debug:
+                logger.debug("[SIZE_DEBUG] l2_id=%s, displayCode=%s, sizeCode=%s, final_size_code=%s",
+                             l2_id, size_obj.get('displayCode', ''), size_obj.get('sizeCode', ''), size_code)
+                logger.debug("[SIZE_DEBUG] size_obj fields: name=%s, displayName=%s, label=%s",
+                             size_obj.get('name'), size_obj.get('displayName'), size_obj.get('label'))
+                logger.debug("[SIZE_DEBUG] Final size_name=%s (from SIZE_CODE_MAP: %s)",
+                             size_name, SIZE_CODE_MAP.get(size_code, 'NOT_FOUND'))
             
-            # Try multiple fields to get size name
-            size_name = (
-                size_obj.get('name') or 
-                size_obj.get('displayName') or 
-                size_obj.get('label') or 
-                SIZE_CODE_MAP.get(size_code, size_code)
-            )
-            
-            print(f"[SIZE_DEBUG] Final size_name={size_name} (from SIZE_CODE_MAP: {SIZE_CODE_MAP.get(size_code, 'NOT_FOUND')})")
-            color_code = l2.get('color', {}).get('displayCode', '')
-            is_on_sale = l2.get('sales', False)
-            
-            price_info = prices.get(l2_id, {})
-            base_price = price_info.get('base', {}).get('value', 0)
-            promo_price = price_info.get('promo', {}).get('value', 0) if is_on_sale else base_price
-            
-            stock_info = stocks.get(l2_id, {})
-            stock_status = stock_info.get('statusCode', '')
-            stock_quantity = stock_info.get('quantity', 0)  # Get actual stock quantity
+            color_code = l2.get('color', _EMPTY).get('displayCode', '')
             
             # Debug: Log stock info for troubleshooting
-            if l2_id and stock_info:
-                print(f"[STOCK_DEBUG] l2_id={l2_id}, status={stock_status}, quantity={stock_quantity}, size={size_name}, color={color_code}, store={store_name}")
-            
-            # Include variants with actual stock (quantity > 0) and status IN_STOCK or LOW_STOCK
-            # LOW_STOCK with quantity > 0 means still available
-            # STOCK_OUT or quantity = 0 means not available
-            if stock_quantity > 0 and stock_status in ['IN_STOCK', 'LOW_STOCK']:
-                print(f"[VARIANT_ADDED] ✅ {size_name} {color_code} - qty={stock_quantity}, status={stock_status}, store={store_name}")
-                variants.append({
-                    'l2_id': l2_id,
-                    'size_code': size_code,
-                    'size_name': size_name,  # Add size name (S, M, L, XL)
-                    'color_code': color_code,
-                    'base_price': base_price,
-                    'promo_price': promo_price,
-                    'is_on_sale': is_on_sale,
-                    'store_name': store_name,
-                    'stock_status': stock_status,
-                    'stock_quantity': stock_quantity
-                })
-            else:
-                print(f"[VARIANT_SKIPPED] ❌ {size_name} {color_code} - qty={stock_quantity}, status={stock_status}, store={store_name}")
+            if debug and l2_id and stock_info:
+                logger.debug("[STOCK_DEBUG] l2_id=%s, status=%s, quantity=%s, size=%s, color=%s, store=%s",
+                             l2_id, stock_status, stock_quantity, size_name, color_code, store_name)
+            
+            if in_stock:
+                if debug:
+                    logger.debug("[VARIANT_ADDED] %s %s - qty=%s, status=%s, store=%s",
+                                 size_name, color_code, stock_quantity, stock_status, store_name)
+                is_on_sale = l2.get('sales', False)
+                price_info = prices.get(l2_id, _EMPTY)
+                base_price = price_info.get('base', _EMPTY).get('value', 0)
+                promo_price = price_info.get('promo', _EMPTY).get('value', 0) if is_on_sale else base_price
+                append(Variant(
+                    l2_id=l2_id,
+                    size_code=size_code,
+                    size_name=size_name,  # Add size name (S, M, L, XL)
+                    color_code=color_code,
+                    base_price=base_price,
+                    promo_price=promo_price,
+                    is_on_sale=is_on_sale,
+                    store_name=store_name,
+                    stock_status=stock_status,
+                    stock_quantity=stock_quantity,
+                    store_id=store_id,
+                    on_sale_effective=bool(is_on_sale and base_price > promo_price)
+                ))
+            elif debug:
+                logger.debug("[VARIANT_SKIPPED] %s %s - qty=%s, status=%s, store=%s",
+                             size_name, color_code, stock_quantity, stock_status, store_name)
         
         return variants
     
@@ -460,21 +532,25 @@ class UniqloAPI:
             if not product_id:
                 return None
             
-            # Try to fetch product page to get name
-            response = self.session.get(url, timeout=10)
-            if response.status_code == 200:
-                # Try to extract from HTML title or meta tags
-                from bs4 import BeautifulSoup
-                soup = BeautifulSoup(response.text, 'html.parser')
-                title = soup.find('title')
-                if title:
-                    # Extract product name from title
-                    title_text = title.get_text()
-                    # Remove common suffixes
-                    name = title_text.split('|')[0].strip() if '|' in title_text else title_text
-                    return name
+            # Try to fetch product page to get name; <title> sits in <head>, so stop reading once it's found
+            with self.session.get(url, timeout=10, stream=True) as response:
+                if response.status_code != 200:
+                    return None
+                head = b''
+                match = None
+                for chunk in response.iter_content(chunk_size=16384):
+                    head += chunk
+                    match = _TITLE_RE.search(head)
+                    if match or len(head) >= _TITLE_MAX_BYTES:
+                        break
+            
+            if match:
+                # Extract product name from title
+                title_text = html.unescape(match.group(1).decode('utf-8', errors='replace'))
+                # Remove common suffixes
+                return title_text.split('|', 1)[0].strip()
         except Exception as e:
-            print(f"Error getting product name: {e}")
+            logger.error("Error getting product name: %s", e)
         
         return None
 